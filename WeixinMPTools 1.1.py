@@ -4,10 +4,8 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk, ImageDraw
 import os
-from pathlib import Path
 import math
 import requests
-import re
 import sys
 import tempfile
 import time
@@ -15,9 +13,20 @@ import threading
 from datetime import datetime
 from packaging import version
 import pyperclip
-import io
 import webbrowser
 import base64
+import multiprocessing
+import queue
+import sqlite3
+from image_classifier import PRESETS
+from image_metrics import DEFAULT_MIN_SSIM, SSIM_AVAILABLE
+from image_compressor import (CONVERT_FORMATS, CompressOptions, CompressionJob, format_supported, iter_scan_images, scan_images,
+                              scan_path, summarize_scan)
+from compress_index import DEFAULT_INDEX_PATH
+from cover_cache import CoverCache
+from cover_extractor import CoverJob, DEFAULT_WORKERS, default_output_dir, parse_article_urls, read_url_file, write_manifest
+from fetch_session import FetchSession
+from stage_timer import PerfLog, StageTimer
 
 
 def check_for_updates(current_version: str, repo: str = "SorakageMeiou/WeixinMPTools", root=None):
@@ -66,6 +75,11 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
+JOB_POLL_INTERVAL_MS = 100  # 界面轮询后台任务队列的间隔
+JOB_MAX_EVENTS_PER_POLL = 2000  # 每次轮询最多处理的事件数，避免长时间占用事件循环
+SINGLE_SEARCH_THREADS = min(os.cpu_count() or 1, 4)  # 单文件压缩时同时试编码的线程数
+
+
 class WeChatTools:
     def __init__(self, root):
         self.root = root
@@ -98,10 +112,17 @@ class WeChatTools:
         self.compress_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.compress_frame, text="图片压缩")
         
+        self.diagnostics_frame = ttk.Frame(self.notebook)
+        self.notebook.add(self.diagnostics_frame, text="性能诊断")
+        
+        # 各工具的分阶段耗时记录
+        self.perf_log = PerfLog()
+        
         # 初始化
         self.init_image_stitching_tool()
         self.init_cover_extraction_tool()
         self.init_image_compressor_tool()
+        self.init_diagnostics_tool()
         
         # 底部状态栏和GitHub按钮
         self.create_bottom_bar()
@@ -645,33 +666,41 @@ class WeChatTools:
             messagebox.showwarning("警告", "请先完成两张图片的裁剪")
             return
         
+        timer = StageTimer()
+        
         # 计算输出宽度（取较小宽度）
         output_width = min(self.top_cropped.width, self.bottom_cropped.width)
         
-        # 按比例调整上方图尺寸
-        top_height = int(output_width / self.top_ratio)
-        top_resized = self.top_cropped.resize((output_width, top_height), Image.Resampling.LANCZOS)
-        
-        # 按比例调整下方图尺寸
-        bottom_resized = self.bottom_cropped.resize((output_width, output_width), Image.Resampling.LANCZOS)
+        with timer.stage("resize") as stage:
+            # 按比例调整上方图尺寸
+            top_height = int(output_width / self.top_ratio)
+            top_resized = self.top_cropped.resize((output_width, top_height), Image.Resampling.LANCZOS)
+            
+            # 按比例调整下方图尺寸
+            bottom_resized = self.bottom_cropped.resize((output_width, output_width), Image.Resampling.LANCZOS)
+            stage.bytes = output_width * (top_height + output_width) * len(top_resized.getbands())
         
         # 计算拼接后的总高度
         total_height = top_resized.height + bottom_resized.height
         
-        # 创建新图片
-        if self.bg_var.get() == "transparent":
-            stitched = Image.new("RGBA", (output_width, total_height), (0, 0, 0, 0))
-        else:
-            stitched = Image.new("RGB", (output_width, total_height), "white")
-        
-        # 放置上方图（左对齐，实际上因为宽度相同就是完全对齐）
-        stitched.paste(top_resized, (0, 0))
-        
-        # 放置下方图（水平居中，实际上因为宽度相同就是完全对齐）
-        stitched.paste(bottom_resized, (0, top_resized.height))
+        with timer.stage("compose") as stage:
+            # 创建新图片
+            if self.bg_var.get() == "transparent":
+                stitched = Image.new("RGBA", (output_width, total_height), (0, 0, 0, 0))
+            else:
+                stitched = Image.new("RGB", (output_width, total_height), "white")
+            
+            # 放置上方图（左对齐，实际上因为宽度相同就是完全对齐）
+            stitched.paste(top_resized, (0, 0))
+            
+            # 放置下方图（水平居中，实际上因为宽度相同就是完全对齐）
+            stitched.paste(bottom_resized, (0, top_resized.height))
+            stage.bytes = output_width * total_height * len(stitched.getbands())
         
         self.stitched_image = stitched
-        self.update_stitch_preview()
+        with timer.stage("preview"):
+            self.update_stitch_preview()
+        self.perf_log.add("图片拼接", f"{output_width}x{total_height}", timer.stages)
         messagebox.showinfo("成功", "图片拼接完成")
     
     def save_image(self):
@@ -686,16 +715,20 @@ class WeChatTools:
         )
         
         if file_path:
+            timer = StageTimer()
+            image, image_format = self.stitched_image, "PNG"
             if file_path.lower().endswith('.jpg') or file_path.lower().endswith('.jpeg'):
+                image_format = "JPEG"
                 # 如果是JPEG格式，需要转换为RGB模式
-                if self.stitched_image.mode == 'RGBA':
-                    rgb_image = Image.new('RGB', self.stitched_image.size, 'white')
-                    rgb_image.paste(self.stitched_image, mask=self.stitched_image.split()[-1])
-                    rgb_image.save(file_path, "JPEG")
-                else:
-                    self.stitched_image.save(file_path, "JPEG")
-            else:
-                self.stitched_image.save(file_path, "PNG")
+                if image.mode == 'RGBA':
+                    with timer.stage("convert"):
+                        image = Image.new('RGB', self.stitched_image.size, 'white')
+                        image.paste(self.stitched_image, mask=self.stitched_image.split()[-1])
+            with timer.stage("encode") as stage:
+                image.save(file_path, image_format)
+                # 需在 with 块内设置，退出时才会计入该阶段的累计值
+                stage.bytes = os.path.getsize(file_path)
+            self.perf_log.add("图片拼接-保存", os.path.basename(file_path), timer.stages)
             
             messagebox.showinfo("成功", f"图片已保存到: {file_path}")
     
@@ -732,6 +765,7 @@ class WeChatTools:
         info_text.insert(tk.END, "• 输入公众号文章链接，自动提取封面图\n")
         info_text.insert(tk.END, "• 提取的图片链接会自动复制到剪贴板\n")
         info_text.insert(tk.END, "• 图片会自动下载到当前用户桌面\n")
+        info_text.insert(tk.END, "• 批量提取：粘贴多条链接或导入 txt/CSV 文件，封面图和清单 (CSV) 保存到桌面的新文件夹\n")
         info_text.insert(tk.END, "• 有bug联系QQ: Sorakagemo\n")
         info_text.insert(tk.END, "• 更新日期: 2025/11/19")
         info_text.config(state=tk.DISABLED)
@@ -746,13 +780,48 @@ class WeChatTools:
         
         # 按钮区域
         button_frame = ttk.Frame(main_frame)
-        button_frame.pack(fill=tk.X, pady=(0, 20))
+        button_frame.pack(fill=tk.X, pady=(0, 10))
         
-        ttk.Button(button_frame, text="提取封面图", 
-                  command=self.extract_cover_image).pack(side=tk.LEFT, padx=(0, 10))
+        self.extract_button = ttk.Button(button_frame, text="提取封面图", command=self.extract_cover_image)
+        self.extract_button.pack(side=tk.LEFT, padx=(0, 10))
         
         ttk.Button(button_frame, text="清空", 
-                  command=self.clear_url).pack(side=tk.LEFT)
+                  command=self.clear_url).pack(side=tk.LEFT, padx=(0, 10))
+        
+        # 重复提取同一篇文章时使用缓存，不再重新下载
+        self.use_cover_cache = tk.BooleanVar(value=True)
+        ttk.Checkbutton(button_frame, text="使用本地缓存", variable=self.use_cover_cache).pack(side=tk.LEFT, padx=(0, 10))
+        # 超过大小上限的封面图下载后直接在内存中压缩（使用"图片压缩"页的设置）
+        self.compress_covers = tk.BooleanVar(value=False)
+        ttk.Checkbutton(button_frame, text="按压缩设置压缩", variable=self.compress_covers).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(button_frame, text="清空缓存", 
+                  command=self.clear_cover_cache).pack(side=tk.LEFT)
+        
+        # 批量提取区域
+        batch_frame = ttk.LabelFrame(main_frame, text="批量提取（每行一个链接，也可粘贴含链接的表格内容）", padding=10)
+        batch_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        self.batch_url_text = tk.Text(batch_frame, height=5, wrap=tk.NONE)
+        self.batch_url_text.pack(fill=tk.X, pady=(0, 5))
+        
+        batch_buttons = ttk.Frame(batch_frame)
+        batch_buttons.pack(fill=tk.X)
+        
+        ttk.Button(batch_buttons, text="从文件导入", 
+                  command=self.import_article_urls).pack(side=tk.LEFT, padx=(0, 10))
+        self.batch_extract_button = ttk.Button(batch_buttons, text="批量提取", command=self.batch_extract_covers)
+        self.batch_extract_button.pack(side=tk.LEFT, padx=(0, 10))
+        self.cancel_extract_button = ttk.Button(batch_buttons, text="取消", command=self.cancel_cover_job,
+                                                state='disabled')
+        self.cancel_extract_button.pack(side=tk.LEFT, padx=(0, 10))
+        
+        ttk.Label(batch_buttons, text="同时请求:").pack(side=tk.LEFT)
+        self.extract_workers = tk.IntVar(value=DEFAULT_WORKERS)
+        ttk.Spinbox(batch_buttons, from_=1, to=32, textvariable=self.extract_workers, width=5).pack(
+            side=tk.LEFT, padx=(5, 10))
+        
+        self.extract_status = ttk.Label(batch_buttons, text="")
+        self.extract_status.pack(side=tk.LEFT)
         
         # 结果显示区域
         result_frame = ttk.LabelFrame(main_frame, text="提取结果", padding=10)
@@ -764,90 +833,195 @@ class WeChatTools:
         
         self.result_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.cover_job = None
+        # 所有提取共用连接，多次提取时不再重复建立连接
+        self.fetch_session = FetchSession()
+        try:
+            self.cover_cache = CoverCache()
+        except (OSError, sqlite3.Error) as e:
+            print(f"无法打开封面图缓存: {e}")
+            self.cover_cache = None
     
     def extract_cover_image(self):
         url = self.url_entry.get().strip()
         if not url:
             messagebox.showwarning("警告", "请输入公众号链接")
             return
+        if self.cover_job is not None:
+            return
         
         self.result_text.delete(1.0, tk.END)
         self.result_text.insert(tk.END, "正在连接服务器...\n")
-        self.root.update()
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
-        }
-        
-        try:
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-        except Exception as e:
-            self.result_text.insert(tk.END, f"连接失败，请检查网络或网址是否正确: {e}\n")
+        # 在后台线程中请求，网络较慢时界面不会卡住
+        self.start_cover_job(CoverJob([url], workers=1, session=self.fetch_session, cache=self.active_cover_cache,
+                                        compress_options=self.cover_compress_options), self.show_cover_result, lambda state: None)
+    
+    @property
+    def active_cover_cache(self):
+        return self.cover_cache if self.use_cover_cache.get() else None
+    
+    @property
+    def cover_compress_options(self):
+        return self.compression_options() if self.compress_covers.get() else None
+    
+    def clear_cover_cache(self):
+        if self.cover_cache is None or self.cover_job is not None:
+            return
+        if messagebox.askyesno("确认", "确定要清空封面图缓存吗？\n已保存的封面图不受影响"):
+            self.cover_cache.clear()
+    
+    def show_cover_result(self, result):
+        """显示单个链接的提取结果"""
+        # 失败时也记录已完成的阶段，便于判断卡在哪一步
+        self.perf_log.add("封面图提取", result.url, result.stages)
+        if result.image_url is None:
+            self.result_text.insert(tk.END, f"{result.error}\n")
             return
         
-        html = response.text
-        
-        # 方法1：尝试匹配 JS 中的 msg_cdn_url
-        url_match = re.search(r'var\s+msg_cdn_url\s*=\s*"([^"]+)"', html)
-        if url_match:
-            image_url = url_match.group(1)
-        else:
-            # 方法2：尝试匹配 meta og:image 标签
-            url_match = re.search(r'<meta property="og:image" content="(.*?)"', html)
-            if url_match:
-                image_url = url_match.group(1)
-            else:
-                self.result_text.insert(tk.END, "未找到封面图链接，请确认是公众号文章页\n")
-                return
-        
-        self.result_text.insert(tk.END, f"找到封面图地址：{image_url}\n")
+        cached = "（缓存）" if result.cached else ""
+        self.result_text.insert(tk.END, f"找到封面图地址{cached}：{result.image_url}\n")
         
         # 复制到剪贴板
         try:
-            pyperclip.copy(image_url)
+            pyperclip.copy(result.image_url)
             self.result_text.insert(tk.END, "图片链接已复制到剪贴板\n")
         except Exception as e:
             self.result_text.insert(tk.END, f"复制到剪贴板失败: {e}\n")
         
-        # 下载图片
-        self.result_text.insert(tk.END, "正在下载图片...\n")
-        self.root.update()
+        if result.success:
+            compressed = "（已压缩）" if result.compressed else ""
+            self.result_text.insert(tk.END, f"图片已保存为{compressed}: {result.path}\n")
+            messagebox.showinfo("成功", f"封面图提取完成！\n图片已保存为: {result.path}")
+        else:
+            self.result_text.insert(tk.END, f"{result.error}\n")
+            messagebox.showerror("错误", f"下载图片失败: {result.error}")
+    
+    def import_article_urls(self):
+        file_path = filedialog.askopenfilename(
+            title="选择链接列表",
+            filetypes=[("文本或表格", "*.txt *.csv"), ("所有文件", "*.*")]
+        )
+        if not file_path:
+            return
+        try:
+            urls = read_url_file(file_path)
+        except OSError as e:
+            messagebox.showerror("错误", f"读取文件失败: {e}")
+            return
+        if not urls:
+            messagebox.showwarning("警告", "文件中没有找到公众号文章链接")
+            return
+        self.batch_url_text.delete(1.0, tk.END)
+        self.batch_url_text.insert(tk.END, "\n".join(urls))
+        self.extract_status.config(text=f"已导入 {len(urls)} 个链接")
+    
+    def batch_extract_covers(self):
+        if self.cover_job is not None:
+            return
+        urls = parse_article_urls(self.batch_url_text.get(1.0, tk.END))
+        if not urls:
+            messagebox.showwarning("警告", "请粘贴或导入公众号文章链接")
+            return
+        try:
+            workers = self.extract_workers.get()
+        except tk.TclError:
+            workers = DEFAULT_WORKERS
         
+        output_dir = os.path.join(default_output_dir(), f"covers_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
         try:
-            file_path = self.save_image_from_url(image_url)
-            self.result_text.insert(tk.END, f"图片已保存为: {file_path}\n")
-            messagebox.showinfo("成功", f"封面图提取完成！\n图片已保存为: {file_path}")
-        except Exception as e:
-            self.result_text.insert(tk.END, f"下载图片时发生错误: {e}\n")
-            messagebox.showerror("错误", f"下载图片失败: {e}")
+            os.makedirs(output_dir, exist_ok=True)
+        except OSError as e:
+            messagebox.showerror("错误", f"无法创建保存目录: {e}")
+            return
+        
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(tk.END, f"共 {len(urls)} 个链接，保存到: {output_dir}\n")
+        job = CoverJob(urls, output_dir, workers=max(1, min(workers, 32)), session=self.fetch_session,
+                       cache=self.active_cover_cache, compress_options=self.cover_compress_options)
+        self.start_cover_job(job, self.show_batch_cover_result, self.finish_batch_covers)
     
-    def save_image_from_url(self, image_url):
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
-        }
-        response = requests.get(image_url, stream=True, headers=headers, timeout=10)
-        if response.status_code == 200:
-            desktop = Path.home() / "Desktop"
-            if not desktop.exists():
-                desktop = Path.home()
-            
-            current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_name = f"cover_{current_time}.jpg"
-            file_path = desktop / file_name
-
-
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(1024):
-                    f.write(chunk)
-
-            return str(file_path)
+    def show_batch_cover_result(self, result):
+        """批量提取时每完成一个链接追加一行"""
+        self.perf_log.add("封面图提取", result.url, result.stages)
+        if result.success:
+            line = f"[成功{'·缓存' if result.cached else ''} {result.elapsed:.2f}s] {result.url}\n    → {result.path}\n"
         else:
-            raise Exception(f"服务器返回错误: {response.status_code}")
+            line = f"[失败 {result.elapsed:.2f}s] {result.url}\n    {result.error}\n"
+        self.result_text.insert(tk.END, line)
+        self.result_text.see(tk.END)
+    
+    def finish_batch_covers(self, state):
+        job = self.last_cover_job
+        succeeded = sum(1 for result in job.results if result.success)
+        manifest_path = os.path.join(job.output_dir, "manifest.csv")
+        try:
+            write_manifest(job.results, manifest_path)
+        except OSError as e:
+            manifest_path = None
+            self.result_text.insert(tk.END, f"写入清单失败: {e}\n")
+        
+        title = "已取消" if state == "cancelled" else "完成"
+        summary = f"批量提取{title}：成功 {succeeded} 个，失败 {len(job.results) - succeeded} 个"
+        if len(job.results) < len(job.urls):
+            summary += f"，未处理 {len(job.urls) - len(job.results)} 个"
+        if manifest_path:
+            summary += f"\n清单已保存为: {manifest_path}"
+        self.result_text.insert(tk.END, summary + "\n")
+        self.result_text.see(tk.END)
+        messagebox.showinfo(title, summary)
+    
+    def start_cover_job(self, job, on_result, on_done):
+        """启动后台提取任务，界面线程定时取回结果"""
+        self.cover_job = self.last_cover_job = job
+        self._cover_handlers = (on_result, on_done)
+        job.start()
+        self.update_cover_controls()
+        self.root.after(JOB_POLL_INTERVAL_MS, self.poll_cover_job)
+    
+    def poll_cover_job(self):
+        job = self.cover_job
+        if job is None:
+            return
+        on_result, on_done = self._cover_handlers
+        
+        while True:
+            try:
+                kind, payload = job.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'result':
+                on_result(payload)
+            elif kind == 'done':
+                self.cover_job = None
+                self._cover_handlers = None
+                self.update_cover_controls()
+                on_done(payload)
+                return
+        
+        self.update_cover_controls()
+        self.root.after(JOB_POLL_INTERVAL_MS, self.poll_cover_job)
+    
+    def update_cover_controls(self):
+        job = self.cover_job
+        busy = job is not None
+        self.extract_button.config(state='disabled' if busy else 'normal')
+        self.batch_extract_button.config(state='disabled' if busy else 'normal')
+        self.cancel_extract_button.config(state='normal' if busy and job.state == "running" and len(job.urls) > 1
+                                          else 'disabled')
+        if busy and len(job.urls) > 1:
+            self.extract_status.config(text=f"进度: {job.completed}/{len(job.urls)}")
+    
+    def cancel_cover_job(self):
+        if self.cover_job is not None:
+            self.cover_job.cancel()
+            self.update_cover_controls()
     
     def clear_url(self):
         self.url_entry.delete(0, tk.END)
+        self.batch_url_text.delete(1.0, tk.END)
         self.result_text.delete(1.0, tk.END)
+        self.extract_status.config(text="")
 
     # ==================== 图片压缩工具 ====================
     def init_image_compressor_tool(self):
@@ -857,8 +1031,17 @@ class WeChatTools:
         self.quality = tk.IntVar(value=80)
         self.max_size_mb = tk.IntVar(value=10)
         self.include_subfolders = tk.BooleanVar(value=True)
-        self.compression_in_progress = False
+        self.use_compress_index = tk.BooleanVar(value=True)
+        self.scan_before_batch = tk.BooleanVar(value=True)
+        self.compression_job = None
+        self._job_handlers = None
+        self.batch_scanning = False     # 批量压缩前正在后台扫描文件夹
         self.png_strategy = tk.StringVar(value="auto")
+        self.worker_count = tk.IntVar(value=os.cpu_count() or 1)
+        self.parallel_search = tk.BooleanVar(value=SINGLE_SEARCH_THREADS > 1)
+        self.memory_budget_mb = tk.IntVar(value=0)
+        self.content_aware = tk.BooleanVar(value=True)
+        self.min_ssim = tk.DoubleVar(value=0.0)
         
         self.create_compressor_widgets()
     
@@ -916,17 +1099,20 @@ class WeChatTools:
                  variable=self.quality).grid(row=0, column=0, sticky="ew")
         ttk.Label(quality_frame, textvariable=self.quality).grid(row=0, column=1, padx=5)
         
+        ttk.Checkbutton(frame, text=f"多线程同时试编码多个质量 ({SINGLE_SEARCH_THREADS} 线程，多核电脑上更快)",
+                        variable=self.parallel_search).grid(row=4, column=0, sticky="w")
+        
         ttk.Button(frame, text="压缩图片", command=self.compress_single, 
-                  style="Accent.TButton").grid(row=4, column=0, pady=15)
+                  style="Accent.TButton").grid(row=5, column=0, pady=15)
         
         self.file_info = tk.Text(frame, height=6, width=40, state='disabled')
-        self.file_info.grid(row=5, column=0, sticky="nsew")
+        self.file_info.grid(row=6, column=0, sticky="nsew")
         
         scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.file_info.yview)
-        scrollbar.grid(row=5, column=1, sticky="ns")
+        scrollbar.grid(row=6, column=1, sticky="ns")
         self.file_info['yscrollcommand'] = scrollbar.set
         
-        frame.grid_rowconfigure(5, weight=1)
+        frame.grid_rowconfigure(6, weight=1)
     
     def create_batch_tab(self, parent):
         parent.grid_columnconfigure(0, weight=1)
@@ -944,8 +1130,14 @@ class WeChatTools:
         ttk.Entry(folder_frame, textvariable=self.folder_path, state='readonly').grid(row=0, column=0, sticky="ew")
         ttk.Button(folder_frame, text="浏览...", command=self.select_folder).grid(row=0, column=1, padx=(5, 0))
         
-        ttk.Checkbutton(frame, text="包含子目录", variable=self.include_subfolders).grid(
-            row=2, column=0, sticky="w", pady=(5, 10))
+        option_frame = ttk.Frame(frame)
+        option_frame.grid(row=2, column=0, sticky="w", pady=(5, 10))
+        ttk.Checkbutton(option_frame, text="包含子目录", variable=self.include_subfolders).grid(
+            row=0, column=0, sticky="w")
+        ttk.Checkbutton(option_frame, text="跳过已压缩且未改动的文件", variable=self.use_compress_index).grid(
+            row=0, column=1, sticky="w", padx=(20, 0))
+        ttk.Checkbutton(option_frame, text="先扫描并确认 (取消勾选则边扫描边压缩)",
+                        variable=self.scan_before_batch).grid(row=0, column=2, sticky="w", padx=(20, 0))
         
         ttk.Label(frame, text="压缩质量 (0-100):").grid(row=3, column=0, sticky="w", pady=(5, 5))
         
@@ -957,8 +1149,17 @@ class WeChatTools:
                  variable=self.quality).grid(row=0, column=0, sticky="ew")
         ttk.Label(quality_frame, textvariable=self.quality).grid(row=0, column=1, padx=5)
         
-        ttk.Button(frame, text="开始批量压缩", command=self.compress_batch, 
-                  style="Accent.TButton").grid(row=5, column=0, pady=15)
+        button_frame = ttk.Frame(frame)
+        button_frame.grid(row=5, column=0, pady=15)
+        
+        ttk.Button(button_frame, text="开始批量压缩", command=self.compress_batch, 
+                  style="Accent.TButton").grid(row=0, column=0)
+        self.pause_button = ttk.Button(button_frame, text="暂停", command=self.toggle_pause_compression,
+                                       state='disabled')
+        self.pause_button.grid(row=0, column=1, padx=(10, 0))
+        self.cancel_button = ttk.Button(button_frame, text="取消", command=self.cancel_compression,
+                                        state='disabled')
+        self.cancel_button.grid(row=0, column=2, padx=(10, 0))
         
         self.progress = ttk.Progressbar(frame, orient="horizontal", mode='determinate')
         self.progress.grid(row=6, column=0, sticky="ew", pady=(0, 10))
@@ -990,15 +1191,55 @@ class WeChatTools:
         
         ttk.Radiobutton(frame, text="自动转为JPEG (压缩率更高)", 
                        variable=self.png_strategy, value="auto").grid(row=3, column=0, sticky="w")
+        ttk.Radiobutton(frame, text="转为WebP (保留透明度，体积远小于PNG)",
+                       variable=self.png_strategy, value="webp",
+                       state='normal' if format_supported("WEBP") else 'disabled').grid(row=4, column=0, sticky="w")
+        ttk.Radiobutton(frame, text="转为AVIF (保留透明度，体积最小，编码较慢)" if format_supported("AVIF")
+                       else "转为AVIF (当前 Pillow 版本不支持)",
+                       variable=self.png_strategy, value="avif",
+                       state='normal' if format_supported("AVIF") else 'disabled').grid(row=5, column=0, sticky="w")
         ttk.Radiobutton(frame, text="保持PNG格式 (保留透明度)", 
-                       variable=self.png_strategy, value="keep").grid(row=4, column=0, sticky="w", pady=(0, 20))
-        
-        ttk.Button(frame, text="恢复默认设置", command=self.reset_settings).grid(row=5, column=0)
+                       variable=self.png_strategy, value="keep").grid(row=6, column=0, sticky="w")
+        ttk.Checkbutton(frame, text="按内容类型压缩 (照片/截图/文字图分别调参，自动策略下截图、文字图保持PNG)",
+                        variable=self.content_aware).grid(row=7, column=0, sticky="w", pady=(5, 20))
+        
+        ttk.Label(frame, text="感知相似度下限 (SSIM):").grid(row=8, column=0, sticky="w", pady=(0, 10))
+        
+        ssim_frame = ttk.Frame(frame)
+        ssim_frame.grid(row=9, column=0, sticky="w", pady=(0, 20))
+        ttk.Spinbox(ssim_frame, from_=0, to=0.999, increment=0.005, format="%.3f",
+                    textvariable=self.min_ssim, width=7,
+                    state='normal' if SSIM_AVAILABLE else 'disabled').grid(row=0, column=0)
+        ttk.Label(ssim_frame, text=f"(0 为不启用，推荐 {DEFAULT_MIN_SSIM}；满足大小后继续降低质量，输出观感接近原图的最小文件)"
+                  if SSIM_AVAILABLE else "(需要安装 NumPy)").grid(row=0, column=1, padx=5)
+        
+        ttk.Label(frame, text="批量压缩并行进程数:").grid(row=10, column=0, sticky="w", pady=(0, 10))
+        
+        worker_frame = ttk.Frame(frame)
+        worker_frame.grid(row=11, column=0, sticky="w", pady=(0, 20))
+        ttk.Spinbox(worker_frame, from_=1, to=max(os.cpu_count() or 1, 1) * 2,
+                    textvariable=self.worker_count, width=5).grid(row=0, column=0)
+        ttk.Label(worker_frame, text=f"(CPU 核心数: {os.cpu_count() or 1})").grid(row=0, column=1, padx=5)
+        
+        ttk.Label(frame, text="批量压缩内存上限 (MB):").grid(row=12, column=0, sticky="w", pady=(0, 10))
+        
+        memory_frame = ttk.Frame(frame)
+        memory_frame.grid(row=13, column=0, sticky="w", pady=(0, 20))
+        ttk.Spinbox(memory_frame, from_=0, to=65536, increment=256,
+                    textvariable=self.memory_budget_mb, width=7).grid(row=0, column=0)
+        ttk.Label(memory_frame, text="(0 为不限制；按图片尺寸估算内存，超出时减少同时处理的文件数)").grid(
+            row=0, column=1, padx=5)
+        
+        ttk.Button(frame, text="恢复默认设置", command=self.reset_settings).grid(row=14, column=0)
     
     def reset_settings(self):
         self.quality.set(85)
         self.max_size_mb.set(10)
         self.png_strategy.set("auto")
+        self.worker_count.set(os.cpu_count() or 1)
+        self.memory_budget_mb.set(0)
+        self.content_aware.set(True)
+        self.min_ssim.set(0.0)
         messagebox.showinfo("提示", "已恢复默认设置")
         self.status_var.set("已恢复默认设置")
     
@@ -1046,6 +1287,88 @@ class WeChatTools:
             self.status_var.set(f"更新文件信息失败: {str(e)}")
             self.set_error_status(f"更新文件信息失败: {str(e)}")
     
+    def compression_options(self):
+        try:
+            min_ssim = self.min_ssim.get() or None
+        except tk.TclError:
+            min_ssim = None
+        return CompressOptions(quality=self.quality.get(), max_size_mb=self.max_size_mb.get(),
+                               png_strategy=self.png_strategy.get(), content_aware=self.content_aware.get(),
+                               min_ssim=min_ssim if SSIM_AVAILABLE else None)
+    
+    @property
+    def compression_in_progress(self):
+        return self.batch_scanning or (self.compression_job is not None and self.compression_job.is_active)
+    
+    def start_compression_job(self, job, on_result, on_done, on_progress=None):
+        """启动后台任务；on_result 逐个处理结果，on_progress 在每次轮询后刷新界面"""
+        self.compression_job = job
+        self._job_handlers = (on_result, on_done, on_progress)
+        job.start()
+        self.update_job_controls()
+        self.root.after(JOB_POLL_INTERVAL_MS, self.poll_compression_job)
+    
+    def poll_compression_job(self):
+        """在界面线程中消费后台任务事件"""
+        job = self.compression_job
+        if job is None:
+            return
+        on_result, on_done, on_progress = self._job_handlers
+        
+        for _ in range(JOB_MAX_EVENTS_PER_POLL):
+            try:
+                kind, payload = job.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'result':
+                on_result(payload)
+            elif kind == 'done':
+                self.compression_job = None
+                self._job_handlers = None
+                self.update_job_controls()
+                if on_progress:
+                    on_progress(job)
+                on_done(payload)
+                return
+        
+        if on_progress:
+            on_progress(job)
+        self.update_job_controls()
+        self.root.after(JOB_POLL_INTERVAL_MS, self.poll_compression_job)
+    
+    def update_job_controls(self):
+        job = self.compression_job
+        if job is None or not job.is_active:
+            self.pause_button.config(text="暂停", state='disabled')
+            self.cancel_button.config(state='disabled')
+            return
+        if job.state == "cancelling":
+            self.pause_button.config(state='disabled')
+            self.cancel_button.config(state='disabled')
+            return
+        self.pause_button.config(text="继续" if job.state == "paused" else "暂停", state='normal')
+        self.cancel_button.config(state='normal')
+    
+    def toggle_pause_compression(self):
+        job = self.compression_job
+        if job is None:
+            return
+        if job.state == "paused":
+            job.resume()
+            self.status_var.set("已继续批量压缩")
+        else:
+            job.pause()
+            self.status_var.set("已暂停：正在处理的图片完成后停止")
+        self.update_job_controls()
+    
+    def cancel_compression(self):
+        job = self.compression_job
+        if job is None:
+            return
+        job.cancel()
+        self.status_var.set("正在取消：等待正在处理的图片完成...")
+        self.update_job_controls()
+    
     def compress_single(self):
         if self.compression_in_progress:
             return
@@ -1063,35 +1386,51 @@ class WeChatTools:
                 self.status_var.set(f"提示: 原始文件已小于{self.max_size_mb.get()}MB")
                 return
             
-            directory, filename = os.path.split(input_path)
-            name, ext = os.path.splitext(filename)
-            output_filename = f"{name}_compressed_q{self.quality.get()}{ext}"
-            output_path = os.path.join(directory, output_filename)
-            
-            self.compression_in_progress = True
-            success, final_quality = self.compress_image(input_path, output_path, self.quality.get())
-            self.compression_in_progress = False
-            
-            if success:
-                compressed_size = os.path.getsize(output_path) / (1024 * 1024)
-                message = (
-                    f"图片压缩成功!\n\n"
-                    f"原始大小: {original_size:.2f} MB\n"
-                    f"压缩后大小: {compressed_size:.2f} MB\n"
-                    f"最终质量: {final_quality}\n\n"
-                    f"保存在: {output_path}"
-                )
-                messagebox.showinfo("完成", message)
-                self.status_var.set(f"压缩完成! 最终质量: {final_quality}")
-                self.update_file_info(output_path)
-            else:
-                messagebox.showerror("压缩失败", f"图片压缩过程中出现错误")
-                self.set_error_status("图片压缩过程中出现错误")
+            # 单文件直接在后台线程中压缩，省去启动子进程的开销
+            options = self.compression_options()
+            search_threads = SINGLE_SEARCH_THREADS if self.parallel_search.get() else 1
+            job = CompressionJob([scan_path(input_path, options)], options, worker_count=1, use_processes=False,
+                                 search_threads=search_threads)
+            results = []
+            self.status_var.set(f"正在压缩: {os.path.basename(input_path)}")
+            self.start_compression_job(job, results.append,
+                                       lambda state: self.finish_single(results, original_size))
         except Exception as e:
             messagebox.showerror("错误", f"压缩过程中发生错误: {str(e)}")
-            self.compression_in_progress = False
             self.set_error_status(f"压缩错误: {str(e)}")
     
+    def finish_single(self, results, original_size):
+        result = results[0] if results else None
+        if result and result.stages:
+            self.perf_log.add("图片压缩", result.input_path, result.stages)
+        if result and result.success:
+            final_quality, encodes, output_path = result.quality, result.encodes, result.output_path
+            if result.output_format == 'PNG':
+                # PNG 不按质量压缩，显示是否量化为调色板
+                final_quality = f"{result.palette_colors} 色调色板" if result.palette_colors else "无损"
+            compressed_size = result.output_bytes / (1024 * 1024)
+            width, height = result.output_dimensions
+            ssim_line = f"相似度 (SSIM): {result.ssim:.4f}\n" if result.ssim is not None else ""
+            message = (
+                f"图片压缩成功!\n\n"
+                f"原始大小: {original_size:.2f} MB\n"
+                f"压缩后大小: {compressed_size:.2f} MB\n"
+                f"输出尺寸: {width} x {height}\n"
+                f"内容类型: {PRESETS[result.content].label if result.content else '未分类'}\n"
+                f"最终质量: {final_quality}\n"
+                f"{ssim_line}"
+                f"编码次数: {encodes}\n"
+                f"耗时: {result.elapsed:.2f} 秒\n\n"
+                f"保存在: {output_path}"
+            )
+            messagebox.showinfo("完成", message)
+            self.status_var.set(f"压缩完成! 最终质量: {final_quality}, 编码次数: {encodes}")
+            self.update_file_info(output_path)
+        else:
+            error = result.error if result else "任务已取消"
+            messagebox.showerror("压缩失败", f"图片压缩过程中出现错误: {error}")
+            self.set_error_status(f"图片压缩过程中出现错误: {error}")
+    
     def compress_batch(self):
         if self.compression_in_progress:
             return
@@ -1103,149 +1442,274 @@ class WeChatTools:
             return
         
         try:
-            image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
-            image_files = []
-            
-            if self.include_subfolders.get():
-                for root, _, files in os.walk(folder_path):
-                    for file in files:
-                        if file.lower().endswith(image_extensions):
-                            image_files.append(os.path.join(root, file))
-            else:
-                for file in os.listdir(folder_path):
-                    if file.lower().endswith(image_extensions):
-                        image_files.append(os.path.join(folder_path, file))
-            
-            if not image_files:
-                messagebox.showerror("错误", "选择的文件夹中没有找到图片文件")
-                self.set_error_status("文件夹中没有找到图片文件")
+            options = self.compression_options()
+            if self.scan_before_batch.get():
+                # 扫描要读取每张图片的文件头，大文件夹需要较长时间，在后台线程中进行，完成后再确认
+                self.batch_scanning = True
+                self.status_var.set("正在扫描文件夹...")
+                threading.Thread(target=self.background_batch_scan,
+                                 args=(folder_path, self.include_subfolders.get(), options), daemon=True).start()
                 return
-            
-            confirm = messagebox.askyesno("确认", f"找到 {len(image_files)} 张图片，是否开始批量压缩?")
-            if not confirm:
+            # 边扫描边压缩：扫描在后台进行，总数随发现的文件递增
+            if not os.path.isdir(folder_path):
+                raise OSError(f"文件夹不存在: {folder_path}")
+            if not messagebox.askyesno("确认", f"是否开始批量压缩 {folder_path} 中的图片?"):
                 return
+            image_files = iter_scan_images(folder_path, self.include_subfolders.get(), options)
+        except Exception as e:
+            messagebox.showerror("错误", f"批量压缩过程中发生错误: {str(e)}")
+            self.set_error_status(f"批量压缩错误: {str(e)}")
+            return
+        self.start_batch(image_files, 0, options)
+    
+    def background_batch_scan(self, folder_path, include_subfolders, options):
+        """后台扫描文件夹，完成后回到界面线程显示扫描结果并确认是否开始"""
+        try:
+            image_files = scan_images(folder_path, include_subfolders, options)
+        except Exception as e:
+            message = str(e)
             
-            self.compression_in_progress = True
-            self.progress['maximum'] = len(image_files)
-            self.progress['value'] = 0
-            
-            total_original_size = 0
-            total_compressed_size = 0
-            success_count = 0
-            skip_count = 0
-            
-            for i, input_path in enumerate(image_files):
-                self.root.update()
-                self.status_var.set(f"正在处理: {os.path.basename(input_path)} ({i+1}/{len(image_files)})")
-                
-                try:
-                    original_size = os.path.getsize(input_path) / (1024 * 1024)
-                    total_original_size += original_size
-                    
-                    if original_size < self.max_size_mb.get():
-                        skip_count += 1
-                    else:
-                        directory, filename = os.path.split(input_path)
-                        name, ext = os.path.splitext(filename)
-                        output_filename = f"{name}_compressed_q{self.quality.get()}{ext}"
-                        output_path = os.path.join(directory, output_filename)
-                        
-                        success, final_quality = self.compress_image(input_path, output_path, self.quality.get())
-                        
-                        if success:
-                            compressed_size = os.path.getsize(output_path) / (1024 * 1024)
-                            total_compressed_size += compressed_size
-                            success_count += 1
-                    
-                    self.progress['value'] = i + 1
-                except Exception as e:
-                    self.status_var.set(f"处理 {os.path.basename(input_path)} 时出错: {str(e)}")
-                    self.set_error_status(f"处理图片出错: {str(e)}")
+            def show_error():
+                self.batch_scanning = False
+                messagebox.showerror("错误", f"扫描文件夹时发生错误: {message}")
+                self.set_error_status(f"扫描文件夹错误: {message}")
             
-            self.compression_in_progress = False
-            self.status_var.set(f"批量压缩完成! 成功: {success_count}, 跳过: {skip_count}")
+            self.root.after(0, show_error)
+        else:
+            def confirm():
+                self.batch_scanning = False
+                if self.confirm_batch(image_files, options):
+                    self.start_batch(image_files, len(image_files), options)
             
-            info_text = (
-                f"处理完成!\n\n"
-                f"总图片数: {len(image_files)}\n"
-                f"成功压缩: {success_count}\n"
-                f"跳过(已小于{self.max_size_mb.get()}MB): {skip_count}\n\n"
-                f"原始总大小: {total_original_size:.2f} MB\n"
-                f"压缩后总大小: {total_compressed_size:.2f} MB\n"
-                f"节省空间: {total_original_size - total_compressed_size:.2f} MB"
-            )
+            self.root.after(0, confirm)
+    
+    def start_batch(self, image_files, total, options):
+        """按扫描结果（列表）或边扫描边返回的迭代器开始批量压缩，total 为 0 表示总数未知"""
+        try:
+            try:
+                worker_count = max(1, self.worker_count.get())
+            except tk.TclError:
+                worker_count = os.cpu_count() or 1
+            try:
+                memory_budget_mb = max(0, self.memory_budget_mb.get()) or None
+            except tk.TclError:
+                memory_budget_mb = None
             
-            self.batch_info.config(state='normal')
-            self.batch_info.delete(1.0, tk.END)
-            self.batch_info.insert(tk.END, info_text)
-            self.batch_info.config(state='disabled')
+            self.progress['maximum'] = max(total, 1)
+            self.progress['value'] = 0
+            self.batch_stats = {
+                'total': total,
+                'done': 0,
+                'success': 0,
+                'skipped': 0,
+                'up_to_date': 0,
+                'failed': 0,
+                'encodes': 0,
+                'original_bytes': 0,
+                'output_bytes': 0,
+                'max_size_mb': options.max_size_mb,
+                'worker_count': worker_count,
+                'memory_budget_mb': memory_budget_mb,
+            }
             
-            messagebox.showinfo("完成", f"批量压缩完成!\n\n成功压缩 {success_count} 张图片\n跳过 {skip_count} 张已小于{self.max_size_mb.get()}MB的图片")
+            index_path = DEFAULT_INDEX_PATH if self.use_compress_index.get() else None
+            job = CompressionJob(image_files, options, worker_count=worker_count, index_path=index_path,
+                                 memory_budget_mb=memory_budget_mb)
+            self.start_compression_job(job, self.on_batch_result, self.finish_batch, self.refresh_batch_progress)
+            self.status_var.set(f"正在处理 ({worker_count} 个进程)")
         except Exception as e:
             messagebox.showerror("错误", f"批量压缩过程中发生错误: {str(e)}")
-            self.compression_in_progress = False
             self.set_error_status(f"批量压缩错误: {str(e)}")
     
-    def compress_image(self, input_path, output_path, quality):
-        max_size_bytes = self.max_size_mb.get() * 1024 * 1024
+    def confirm_batch(self, image_files, options):
+        """显示扫描结果并确认是否开始"""
+        if not image_files:
+            messagebox.showerror("错误", "选择的文件夹中没有找到图片文件")
+            self.set_error_status("文件夹中没有找到图片文件")
+            return False
+        
+        summary = summarize_scan(image_files)
+        confirm_text = (
+            f"找到 {summary['total']} 张图片:\n\n"
+            f"需要压缩: {summary['compress'] + summary['convert']} 张"
+            f"（其中 {summary['convert']} 张 PNG/GIF 将转为 {CONVERT_FORMATS.get(options.png_strategy, 'JPEG')}"
+            f"{'，截图和文字图保持原格式' if options.content_aware and options.png_strategy == 'auto' else ''}）\n"
+            f"跳过(已小于{options.max_size_mb}MB): {summary['skip']} 张\n"
+            f"无法读取: {summary['error']} 张\n\n"
+            f"待处理: {summary['work_bytes'] / (1024 * 1024):.1f} MB，"
+            f"{summary['work_pixels'] / 1e6:.1f} 百万像素\n\n"
+            f"是否开始批量压缩?"
+        )
+        self.status_var.set(f"扫描完成，找到 {summary['total']} 张图片")
+        return messagebox.askyesno("确认", confirm_text)
+    
+    def on_batch_result(self, result):
+        if result.stages:
+            self.perf_log.add("图片压缩", result.input_path, result.stages)
+        stats = self.batch_stats
+        stats['done'] += 1
+        stats['encodes'] += result.encodes
+        stats['original_bytes'] += result.original_bytes or 0
+        if result.skip_reason == "up_to_date":
+            stats['up_to_date'] += 1
+        elif result.skipped:
+            stats['skipped'] += 1
+        elif result.success:
+            stats['success'] += 1
+            stats['output_bytes'] += result.output_bytes
+        else:
+            stats['failed'] += 1
+            self.set_error_status(f"处理 {os.path.basename(result.input_path or '')} 时出错: {result.error}")
+    
+    def refresh_batch_progress(self, job):
+        stats = self.batch_stats
+        stats['total'] = max(stats['total'], job.discovered)
+        self.progress['maximum'] = max(stats['total'], 1)
+        self.progress['value'] = stats['done']
+        
+        scanning = "" if job.scan_finished else " (扫描中)"
+        paused = " (已暂停)" if job.state == "paused" else ""
+        self.status_var.set(f"正在处理: {stats['done']}/{stats['total']}{scanning}"
+                            f" ({stats['worker_count']} 个进程){paused}")
+        memory = ""
+        if stats['memory_budget_mb']:
+            memory = (f"\n估算内存: {job.memory_in_use / (1024 * 1024):.0f}"
+                      f" / {stats['memory_budget_mb']} MB")
+        self.show_batch_info(
+            f"处理中... {stats['done']}/{stats['total']}{scanning}\n\n"
+            f"成功压缩: {stats['success']}\n"
+            f"跳过: {stats['skipped'] + stats['up_to_date']}\n"
+            f"失败: {stats['failed']}{memory}"
+        )
+    
+    def finish_batch(self, state):
+        stats = self.batch_stats
+        total_original_size = stats['original_bytes'] / (1024 * 1024)
+        total_compressed_size = stats['output_bytes'] / (1024 * 1024)
+        headline = "处理完成!" if state == "finished" else f"已取消! 已处理 {stats['done']}/{stats['total']}"
+        self.status_var.set(f"批量压缩{'完成' if state == 'finished' else '已取消'}! "
+                            f"成功: {stats['success']}, 跳过: {stats['skipped']}")
+        
+        compressed_count = stats['done'] - stats['skipped'] - stats['up_to_date']
+        info_text = (
+            f"{headline}\n\n"
+            f"总图片数: {stats['total']}\n"
+            f"成功压缩: {stats['success']}\n"
+            f"跳过(已小于{stats['max_size_mb']}MB): {stats['skipped']}\n"
+            f"跳过(已压缩且未改动): {stats['up_to_date']}\n"
+            f"失败: {stats['failed']}\n\n"
+            f"原始总大小: {total_original_size:.2f} MB\n"
+            f"压缩后总大小: {total_compressed_size:.2f} MB\n"
+            f"节省空间: {total_original_size - total_compressed_size:.2f} MB\n"
+            f"总编码次数: {stats['encodes']}"
+            f" (平均 {stats['encodes'] / max(compressed_count, 1):.1f} 次/张)"
+        )
+        self.show_batch_info(info_text)
         
-        try:
-            with Image.open(input_path) as img:
-                original_format = img.format
-                file_base, file_ext = os.path.splitext(output_path)
-                
-                if original_format in ('PNG', 'GIF') and self.png_strategy.get() == "auto":
-                    img = img.convert('RGB')
-                    output_path = f"{file_base}.jpg"
-                    output_format = 'JPEG'
-                else:
-                    output_format = original_format
-                
-                with io.BytesIO() as buffer:
-                    img.save(buffer, format=output_format, quality=quality, optimize=True)
-                    buffer_size = buffer.tell()
-                    
-                    if buffer_size <= max_size_bytes:
-                        with open(output_path, 'wb') as f:
-                            f.write(buffer.getvalue())
-                        return True, quality
-                
-                for q in range(quality - 5, 10, -5):
-                    with io.BytesIO() as buffer:
-                        img.save(buffer, format=output_format, quality=q, optimize=True)
-                        buffer_size = buffer.tell()
-                        
-                        if buffer_size <= max_size_bytes:
-                            with open(output_path, 'wb') as f:
-                                f.write(buffer.getvalue())
-                            return True, q
-                
-                temp_img = img.copy()
-                adjusted_quality = max(quality, 70)
-                
-                while True:
-                    new_width = int(temp_img.width * 0.9)
-                    new_height = int(temp_img.height * 0.9)
-                    temp_img = temp_img.resize((new_width, new_height), Image.LANCZOS)
-                    
-                    with io.BytesIO() as buffer:
-                        temp_img.save(buffer, format=output_format, quality=adjusted_quality, optimize=True)
-                        buffer_size = buffer.tell()
-                        
-                        if buffer_size <= max_size_bytes:
-                            with open(output_path, 'wb') as f:
-                                f.write(buffer.getvalue())
-                            return True, adjusted_quality
-                    
-                    if new_width < 100 or new_height < 100:
-                        self.status_var.set(f"无法将 {os.path.basename(input_path)} 压缩到指定大小")
-                        return False, quality
+        messagebox.showinfo("完成" if state == "finished" else "已取消",
+                            f"批量压缩{'完成' if state == 'finished' else '已取消'}!\n\n"
+                            f"成功压缩 {stats['success']} 张图片\n"
+                            f"跳过 {stats['skipped']} 张已小于{stats['max_size_mb']}MB的图片")
+    
+    def show_batch_info(self, info_text):
+        self.batch_info.config(state='normal')
+        self.batch_info.delete(1.0, tk.END)
+        self.batch_info.insert(tk.END, info_text)
+        self.batch_info.config(state='disabled')
+
+    # ==================== 性能诊断 ====================
+    def init_diagnostics_tool(self):
+        self.create_diagnostics_widgets()
+        # 切换到诊断页时刷新，避免批量压缩期间逐条刷新表格
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_main_tab_changed)
+    
+    def create_diagnostics_widgets(self):
+        main_frame = ttk.Frame(self.diagnostics_frame)
+        main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        title = ttk.Label(main_frame, text="各阶段耗时", font=('Arial', 16))
+        title.pack(pady=(0, 10))
+        
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=(0, 10))
+        ttk.Button(button_frame, text="刷新", command=self.refresh_diagnostics).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="导出 CSV", command=self.export_diagnostics).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Button(button_frame, text="清空", command=self.clear_diagnostics).pack(side=tk.LEFT, padx=(10, 0))
+        
+        summary_frame = ttk.LabelFrame(main_frame, text="阶段汇总", padding=10)
+        summary_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
+        columns = ("tool", "stage", "count", "seconds", "average", "megabytes", "share")
+        headings = ("工具", "阶段", "次数", "总耗时 (秒)", "平均 (毫秒)", "数据量 (MB)", "占比")
+        self.diagnostics_summary = ttk.Treeview(summary_frame, columns=columns, show="headings", height=8)
+        for column, heading in zip(columns, headings):
+            self.diagnostics_summary.heading(column, text=heading)
+            self.diagnostics_summary.column(column, width=110, anchor="e" if column not in ("tool", "stage") else "w")
+        self.diagnostics_summary.pack(fill=tk.BOTH, expand=True)
+        
+        recent_frame = ttk.LabelFrame(main_frame, text="最近操作", padding=10)
+        recent_frame.pack(fill=tk.BOTH, expand=True)
+        columns = ("time", "tool", "target", "total", "stages")
+        headings = ("时间", "工具", "对象", "总耗时 (毫秒)", "阶段明细")
+        self.diagnostics_recent = ttk.Treeview(recent_frame, columns=columns, show="headings", height=10)
+        for column, heading in zip(columns, headings):
+            self.diagnostics_recent.heading(column, text=heading)
+        self.diagnostics_recent.column("time", width=140, stretch=False)
+        self.diagnostics_recent.column("tool", width=100, stretch=False)
+        self.diagnostics_recent.column("total", width=100, stretch=False, anchor="e")
+        scrollbar = ttk.Scrollbar(recent_frame, orient=tk.VERTICAL, command=self.diagnostics_recent.yview)
+        self.diagnostics_recent.configure(yscrollcommand=scrollbar.set)
+        self.diagnostics_recent.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    
+    def on_main_tab_changed(self, event):
+        if self.notebook.select() == str(self.diagnostics_frame):
+            self.refresh_diagnostics()
+    
+    def refresh_diagnostics(self):
+        self.diagnostics_summary.delete(*self.diagnostics_summary.get_children())
+        for tool, stages in self.perf_log.summary().items():
+            tool_seconds = sum(stage.seconds for stage in stages) or 1
+            for stage in stages:
+                self.diagnostics_summary.insert("", tk.END, values=(
+                    tool, stage.name, stage.count, f"{stage.seconds:.3f}",
+                    f"{stage.seconds * 1000 / max(stage.count, 1):.1f}",
+                    f"{stage.bytes / (1024 * 1024):.2f}", f"{stage.seconds / tool_seconds:.0%}"))
+        
+        self.diagnostics_recent.delete(*self.diagnostics_recent.get_children())
+        for record in reversed(self.perf_log.records):
+            details = ", ".join(f"{stage.name} {stage.seconds * 1000:.0f}ms"
+                                + (f" x{stage.count}" if stage.count > 1 else "") for stage in record.stages)
+            self.diagnostics_recent.insert("", tk.END, values=(
+                record.time, record.tool, os.path.basename(record.target) or record.target,
+                f"{record.total_seconds * 1000:.0f}", details))
+    
+    def export_diagnostics(self):
+        if not self.perf_log.records:
+            messagebox.showwarning("警告", "还没有可导出的记录")
+            return
         
+        file_path = filedialog.asksaveasfilename(
+            title="导出性能数据",
+            defaultextension=".csv",
+            initialfile=f"perf_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            filetypes=[("CSV 文件", "*.csv")]
+        )
+        if not file_path:
+            return
+        try:
+            self.perf_log.write_csv(file_path)
+            self.status_var.set(f"性能数据已导出到: {file_path}")
         except Exception as e:
-            self.status_var.set(f"处理 {os.path.basename(input_path)} 时出错: {str(e)}")
-            return False, quality
+            messagebox.showerror("错误", f"导出失败: {e}")
+            self.set_error_status(f"导出失败: {e}")
+    
+    def clear_diagnostics(self):
+        self.perf_log.clear()
+        self.refresh_diagnostics()
+        self.status_var.set("已清空性能记录")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包为 exe 后子进程需要
     root = tk.Tk()
     app = WeChatTools(root)
     root.mainloop()
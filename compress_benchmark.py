@@ -0,0 +1,314 @@
+"""公众号工具集 - 图片压缩基准测试
+
+在本地生成固定随机种子的合成图片（照片、截图、透明 PNG、GIF 动图，多种分辨率），
+逐个调用压缩引擎，统计吞吐量、编码次数、峰值内存和输出体积与上限的贴合程度，
+结果保存为 JSON，便于对比不同版本。
+
+用法示例:
+    python compress_benchmark.py -o bench_new.json
+    python compress_benchmark.py -o bench_new.json --compare bench_old.json
+    python compress_benchmark.py --max-size 1 --resolutions large
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from dataclasses import asdict, replace
+
+import PIL
+from PIL import Image, ImageDraw, ImageFilter
+
+from image_compressor import CompressOptions, compress_file
+
+RESOLUTIONS = {                 # 各档分辨率
+    'small': (800, 600),
+    'medium': (1920, 1080),
+    'large': (4000, 3000),
+    'uneven': (5000, 3333),     # 边长不能被 DCT 缩放比例整除，覆盖草稿解码后的 SSIM 比较
+}
+GIF_SCALE = 0.5                 # GIF 动图按一半分辨率生成，避免语料生成过慢
+GIF_FRAMES = 8                  # GIF 动图帧数
+DEFAULT_TARGET_RATIO = 0.3      # 未指定上限时，每个文件的上限取原大小的 30%，保证都要经过压缩搜索
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), "WeixinMPTools_bench_corpus")
+
+
+def make_photo(size, rng):
+    """模拟照片：低频色块叠加细节噪声"""
+    width, height = size
+    channels = []
+    coarse = (max(width // 16, 1), max(height // 16, 1))
+    for _ in range(3):
+        # 噪声全部取自 rng，保证同一种子生成的语料逐字节一致
+        base = Image.frombytes('L', coarse, rng.randbytes(coarse[0] * coarse[1]))
+        base = base.resize(size, Image.BICUBIC).filter(ImageFilter.GaussianBlur(2))
+        detail = Image.frombytes('L', size, rng.randbytes(width * height))
+        channels.append(Image.blend(base, detail, rng.uniform(0.1, 0.25)))
+    return Image.merge('RGB', channels)
+
+
+def make_screenshot(size, rng):
+    """模拟截图：纯色背景、窗口色块、一张配图和成行的文字"""
+    img = Image.new('RGB', size, (245, 245, 245))
+    draw = ImageDraw.Draw(img)
+    width, height = size
+    picture_size = (width // 2, height // 2)
+    img.paste(make_photo(picture_size, rng), (rng.randrange(width - picture_size[0]), rng.randrange(height - picture_size[1])))
+    for _ in range(6):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle([x0, y0, x0 + rng.randint(50, width // 2), y0 + rng.randint(30, height // 3)], fill=color)
+    line_height = 18
+    for y in range(10, height - line_height, line_height + 6):
+        x = 10 + rng.randrange(40)
+        while x < width - 20:
+            word = rng.randint(4, 12) * 7
+            draw.rectangle([x, y, x + word, y + line_height - 6], fill=(30, 30, 30))
+            x += word + 8
+    return img
+
+
+def make_transparent(size, rng):
+    """模拟透明 PNG：渐变图形配径向透明度"""
+    width, height = size
+    img = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        radius = rng.randint(20, max(width, height) // 4)
+        color = tuple(rng.randrange(256) for _ in range(3)) + (rng.randint(120, 255),)
+        draw.ellipse([x0 - radius, y0 - radius, x0 + radius, y0 + radius], fill=color)
+    alpha = Image.radial_gradient('L').resize(size).point(lambda v: 255 - v)
+    img.putalpha(Image.composite(img.getchannel('A'), alpha, img.getchannel('A')))
+    return img
+
+
+def make_animation(size, rng):
+    """模拟 GIF 动图：在噪声背景上移动的色块"""
+    size = (int(size[0] * GIF_SCALE), int(size[1] * GIF_SCALE))
+    width, height = size
+    background = make_photo(size, rng).quantize(64)
+    frames = []
+    for i in range(GIF_FRAMES):
+        frame = background.convert('RGB')
+        draw = ImageDraw.Draw(frame)
+        offset = i * width // (GIF_FRAMES * 2)
+        draw.rectangle([offset, height // 3, offset + width // 4, height // 3 + height // 4], fill=(220, 40, 40))
+        frames.append(frame.quantize(128))
+    return frames
+
+
+SAMPLE_TYPES = {                # 类别: (扩展名, 生成函数)
+    'photo': ('jpg', make_photo),
+    'screenshot': ('png', make_screenshot),
+    'transparent': ('png', make_transparent),
+    'animation': ('gif', make_animation),
+}
+
+
+def save_sample(sample, path):
+    if isinstance(sample, list):
+        sample[0].save(path, save_all=True, append_images=sample[1:], duration=100, loop=0)
+    elif path.endswith('.jpg'):
+        sample.save(path, quality=95)
+    else:
+        sample.save(path)
+
+
+def build_corpus(corpus_dir, resolutions, seed=0):
+    """生成基准测试语料，已存在的文件直接复用，返回 [(类别, 分辨率档, 路径)]"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = []
+    for res_name in resolutions:
+        for category, (extension, generate) in SAMPLE_TYPES.items():
+            name = f"{category}_{res_name}.{extension}"
+            path = os.path.join(corpus_dir, name)
+            if not os.path.exists(path):
+                # 每个文件独立播种，单独删除某个文件后重新生成的结果不变
+                save_sample(generate(RESOLUTIONS[res_name], random.Random(f"{seed}-{name}")), path)
+            corpus.append((category, res_name, path))
+    return corpus
+
+
+def peak_rss_mb():
+    """当前进程的峰值内存 (MB)，无法获取时返回 None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 以 KB 为单位，macOS 以字节为单位
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return round(counters.PeakWorkingSetSize / (1024 * 1024), 1)
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+def summarize(records, elapsed):
+    """汇总一组压缩记录"""
+    compressed = [r for r in records if r['success']]
+    # 原本就在上限以内的文件不参与贴合度统计
+    fills = [r['fill'] for r in compressed if r['over_limit']]
+    input_mb = sum(r['original_bytes'] for r in records) / (1024 * 1024)
+    scores = [r['ssim'] for r in compressed if r.get('ssim') is not None]
+    return {
+        'files': len(records),
+        'failed': len(records) - len(compressed),
+        'elapsed': round(elapsed, 3),
+        'files_per_sec': round(len(records) / elapsed, 3) if elapsed else None,
+        'mb_per_sec': round(input_mb / elapsed, 3) if elapsed else None,
+        'encodes_per_file': round(sum(r['encodes'] for r in records) / len(records), 2) if records else None,
+        'fill_min': round(min(fills), 3) if fills else None,
+        'fill_mean': round(sum(fills) / len(fills), 3) if fills else None,
+        'fill_max': round(max(fills), 3) if fills else None,
+        'ssim_mean': round(sum(scores) / len(scores), 4) if scores else None,
+    }
+
+
+def run_benchmark(corpus, base_options, target_ratio=None, repeat=1, search_threads=1):
+    """逐个压缩语料中的文件，返回基准测试结果
+
+    给出 target_ratio 时，每个文件的上限按原大小乘以该比例设置，忽略 base_options.max_size_mb。
+    search_threads 传给 compress_file，用于对比单文件多线程质量搜索。
+    """
+    records = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for category, res_name, path in corpus:
+            output_path = os.path.join(output_dir, os.path.basename(path))
+            options = base_options
+            if target_ratio:
+                options = replace(base_options, max_size_mb=os.path.getsize(path) * target_ratio / (1024 * 1024))
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = compress_file(path, output_path, options, search_threads=search_threads)
+                timings.append(time.perf_counter() - start)
+            records.append({
+                'file': os.path.basename(path),
+                'category': category,
+                'resolution': res_name,
+                'success': result.success,
+                'error': result.error,
+                'original_bytes': result.original_bytes,
+                'over_limit': result.original_bytes > options.max_size_bytes,
+                'output_bytes': result.output_bytes,
+                'max_size_bytes': options.max_size_bytes,
+                'fill': round(result.output_bytes / options.max_size_bytes, 4),
+                'quality': result.quality,
+                'encodes': result.encodes,
+                'ssim': result.ssim,
+                'original_dimensions': result.original_dimensions,
+                'output_dimensions': result.output_dimensions,
+                # 重复多次时取最快一次，减少系统抖动的影响
+                'elapsed': round(min(timings), 4),
+            })
+
+    elapsed = sum(r['elapsed'] for r in records)
+    return {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'options': asdict(base_options),
+        'target_ratio': target_ratio,
+        'search_threads': search_threads,
+        'summary': summarize(records, elapsed),
+        'by_category': {
+            category: summarize(group, sum(r['elapsed'] for r in group))
+            for category in dict.fromkeys(r['category'] for r in records)
+            for group in [[r for r in records if r['category'] == category]]
+        },
+        'peak_rss_mb': peak_rss_mb(),
+        'files': records,
+    }
+
+
+def compare(old, new):
+    """与旧结果对比，返回可读的差异行"""
+    lines = []
+    for key in ('files_per_sec', 'mb_per_sec', 'encodes_per_file', 'fill_mean', 'fill_min', 'ssim_mean'):
+        before, after = old['summary'].get(key), new['summary'].get(key)
+        if before and after is not None:
+            lines.append(f"{key}: {before} -> {after} ({(after - before) / before:+.1%})")
+    if old.get('peak_rss_mb') and new.get('peak_rss_mb'):
+        lines.append(f"peak_rss_mb: {old['peak_rss_mb']} -> {new['peak_rss_mb']}")
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="在合成图片上测试压缩引擎的速度与体积贴合度")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="结果 JSON 路径，默认 bench_results.json")
+    parser.add_argument("-q", "--quality", type=int, default=80, help="压缩质量 10-100，默认 80")
+    parser.add_argument("-m", "--max-size", type=float,
+                        help=f"统一的最大文件大小 (MB)，默认每个文件取原大小的 {DEFAULT_TARGET_RATIO:.0%}")
+    parser.add_argument("--png-strategy", choices=("auto", "webp", "avif", "keep"), default="auto",
+                        help="auto: PNG/GIF 转为 JPEG；webp/avif: 转为对应格式并保留透明度；keep: 保持原格式")
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTIONS), default=list(RESOLUTIONS),
+                        help="参与测试的分辨率档，默认全部")
+    parser.add_argument("--repeat", type=int, default=1, help="每个文件重复压缩次数，取最快一次，默认 1")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR, help=f"语料目录，默认 {DEFAULT_CORPUS_DIR}")
+    parser.add_argument("--seed", type=int, default=0, help="语料随机种子，默认 0")
+    parser.add_argument("--compare", help="与之前保存的结果 JSON 对比")
+    parser.add_argument("--no-classify", action="store_true", help="关闭按内容类型选择压缩参数，用于对比")
+    parser.add_argument("--min-ssim", type=float, help="感知相似度下限，设置后贴合度会低于不设置时")
+    parser.add_argument("--search-threads", type=int, default=1,
+                        help="单个文件质量搜索的线程数，默认 1（与批量压缩相同）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 语料目录按种子区分，修改种子不会误用旧文件
+    corpus_dir = os.path.join(args.corpus, f"seed{args.seed}")
+    print(f"准备语料: {corpus_dir}", file=sys.stderr)
+    corpus = build_corpus(corpus_dir, args.resolutions, args.seed)
+
+    if args.max_size:
+        options, target_ratio = CompressOptions(quality=args.quality, max_size_mb=args.max_size,
+                                                png_strategy=args.png_strategy), None
+    else:
+        options, target_ratio = CompressOptions(quality=args.quality, png_strategy=args.png_strategy), DEFAULT_TARGET_RATIO
+    options.content_aware, options.min_ssim = not args.no_classify, args.min_ssim
+    report = run_benchmark(corpus, options, target_ratio, repeat=args.repeat, search_threads=args.search_threads)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for category, stats in report['by_category'].items():
+        print(f"{category:12} {stats['files_per_sec']} 张/秒  {stats['mb_per_sec']} MB/秒  "
+              f"平均编码 {stats['encodes_per_file']} 次  贴合度 {stats['fill_min']}~{stats['fill_max']}",
+              file=sys.stderr)
+    summary = report['summary']
+    print(f"合计 {summary['files']} 张，失败 {summary['failed']}，{summary['files_per_sec']} 张/秒，"
+          f"峰值内存 {report['peak_rss_mb']} MB，结果已保存到 {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            for line in compare(json.load(f), report):
+                print(line, file=sys.stderr)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
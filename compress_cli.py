@@ -0,0 +1,97 @@
+"""公众号工具集 - 命令行批量压缩
+
+无需图形界面（不导入 tkinter），适合在构建服务器上批量处理图片。
+每个文件输出一行 JSON 结果，汇总信息输出到 stderr。
+
+用法示例:
+    python compress_cli.py ./images --quality 80 --max-size 10 --png-strategy auto
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+from compress_index import DEFAULT_INDEX_PATH
+from image_compressor import CompressOptions, CompressionJob, iter_scan_images, scan_path
+from image_metrics import DEFAULT_MIN_SSIM, SSIM_AVAILABLE
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批量压缩图片到指定大小以内，逐行输出 JSON 结果")
+    parser.add_argument("folder", help="图片文件夹（也可以是单个图片文件）")
+    parser.add_argument("-q", "--quality", type=int, default=80, help="压缩质量 10-100，默认 80")
+    parser.add_argument("-m", "--max-size", type=float, default=10, help="最大文件大小 (MB)，默认 10")
+    parser.add_argument("--png-strategy", choices=("auto", "webp", "avif", "keep"), default="auto",
+                        help="auto: PNG/GIF 转为 JPEG；webp/avif: 转为对应格式并保留透明度；keep: 保持原格式")
+    parser.add_argument("--no-subfolders", action="store_true", help="不处理子目录")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="并行进程数，默认为 CPU 核心数")
+    parser.add_argument("--index", default=str(DEFAULT_INDEX_PATH),
+                        help=f"压缩记录数据库路径，默认 {DEFAULT_INDEX_PATH}")
+    parser.add_argument("--no-index", action="store_true", help="不使用压缩记录，重新压缩所有文件")
+    parser.add_argument("--search-threads", type=int, default=1,
+                        help="每个文件同时试编码的线程数，默认 1；压缩单个大文件时可设为 CPU 核心数")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="内存上限 (MB)，按图片尺寸估算峰值内存，超出时减少同时处理的文件数")
+    parser.add_argument("--no-draft", action="store_true", help="大尺寸 JPEG 也完整解码，不使用草稿模式")
+    parser.add_argument("--min-ssim", type=float, metavar="SSIM",
+                        help=f"感知相似度下限（如 {DEFAULT_MIN_SSIM}），在满足大小的前提下输出最小的文件，需要 NumPy")
+    parser.add_argument("--no-classify", action="store_true",
+                        help="不按内容类型（照片/截图/文字图）选择压缩参数，自动策略下 PNG/GIF 一律转 JPEG")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    options = CompressOptions(quality=args.quality, max_size_mb=args.max_size, png_strategy=args.png_strategy,
+                              draft_decode=not args.no_draft, content_aware=not args.no_classify,
+                              min_ssim=args.min_ssim)
+    if args.min_ssim and not SSIM_AVAILABLE:
+        print("未安装 NumPy，忽略 --min-ssim，只按大小压缩", file=sys.stderr)
+    if os.path.isfile(args.folder):
+        image_files = [scan_path(args.folder, options)]
+    elif os.path.isdir(args.folder):
+        # 边扫描边压缩，发现第一个文件即开始处理
+        image_files = iter_scan_images(args.folder, not args.no_subfolders, options)
+    else:
+        print(f"路径不存在: {args.folder}", file=sys.stderr)
+        return 2
+
+    job = CompressionJob(image_files, options, worker_count=args.workers,
+                         index_path=None if args.no_index else args.index, memory_budget_mb=args.memory_budget,
+                         search_threads=max(1, args.search_threads))
+    job.start()
+
+    counts = {'success': 0, 'skipped': 0, 'failed': 0}
+    state = None
+    while state is None:
+        try:
+            kind, payload = job.events.get()
+        except KeyboardInterrupt:
+            # Ctrl+C：停止提交新文件，等待正在处理的文件结束
+            job.cancel()
+            continue
+        if kind == 'result':
+            if payload.skipped:
+                counts['skipped'] += 1
+            elif payload.success:
+                counts['success'] += 1
+            else:
+                counts['failed'] += 1
+            print(json.dumps(payload.to_dict(), ensure_ascii=False), flush=True)
+        elif kind == 'done':
+            state = payload
+
+    print(f"{'完成' if state == 'finished' else '已取消'}: 共 {job.discovered} 张，"
+          f"成功 {counts['success']}，跳过 {counts['skipped']}，失败 {counts['failed']}", file=sys.stderr)
+    if state != 'finished':
+        return 130
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
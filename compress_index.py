@@ -0,0 +1,104 @@
+"""公众号工具集 - 压缩记录索引
+
+用 SQLite 记录每个已压缩文件的路径、大小、修改时间、内容哈希、压缩参数和输出文件，
+重复批量压缩同一文件夹时只处理新增或有改动的文件。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+
+DEFAULT_INDEX_PATH = Path.home() / ".WeixinMPTools" / "compress_index.db"
+HASH_CHUNK_SIZE = 1024 * 1024
+COMMIT_EVERY = 50  # 每记录多少个文件提交一次
+
+
+def file_hash(path):
+    """计算文件内容哈希 (BLAKE2b)"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settings_key(options):
+    return json.dumps(asdict(options), sort_keys=True)
+
+
+class CompressionIndex:
+    """压缩记录索引，同一实例只能在创建它的线程中使用"""
+
+    def __init__(self, db_path=DEFAULT_INDEX_PATH):
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " content_hash TEXT NOT NULL,"
+            " settings TEXT NOT NULL,"
+            " output_path TEXT NOT NULL,"
+            " output_size INTEGER NOT NULL,"
+            " final_quality INTEGER,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._uncommitted = 0
+
+    def lookup(self, path, size, mtime_ns, options):
+        """文件未改动、参数相同且输出仍在时返回记录 (output_path, output_size)，否则返回 None"""
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, content_hash, settings, output_path, output_size FROM files WHERE path = ?",
+            (os.path.abspath(path),)).fetchone()
+        if row is None:
+            return None
+        _, recorded_mtime_ns, content_hash, settings, output_path, output_size = row
+        if settings != settings_key(options) or size != row[0]:
+            return None
+        try:
+            if os.path.getsize(output_path) != output_size:
+                return None
+        except OSError:
+            return None
+
+        if mtime_ns != recorded_mtime_ns:
+            # 仅修改时间变化（如复制、touch）：内容哈希一致仍视为已压缩
+            if file_hash(path) != content_hash:
+                return None
+            self.conn.execute("UPDATE files SET mtime_ns = ? WHERE path = ?",
+                              (mtime_ns, os.path.abspath(path)))
+            self._mark_dirty()
+        return output_path, output_size
+
+    def record(self, result, size, mtime_ns, options):
+        """记录一次成功的压缩（result.input_hash 需已计算）"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(result.input_path), size, mtime_ns,
+             result.input_hash, settings_key(options), os.path.abspath(result.output_path),
+             result.output_bytes, result.quality, time.time()))
+        self._mark_dirty()
+
+    def _mark_dirty(self):
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self.conn.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,246 @@
+"""公众号工具集 - 封面图提取缓存
+
+用 SQLite 记录文章链接对应的封面图地址、封面图地址对应的图片内容（按内容哈希存放在缓存目录），
+以及两者的 ETag/Last-Modified。重复提取同一篇文章时：
+- 记录未超过 max_age 直接使用，不访问网络；
+- 超过后带 If-None-Match/If-Modified-Since 请求，服务器返回 304 时继续使用；
+- 网络不通时使用已有记录（离线可用）。
+缓存总大小超过上限时按最近使用时间淘汰图片。以相同方式（原样或同一组压缩参数）保存到
+同一目录的相同图片只保留一份。
+不依赖 tkinter。
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+
+DEFAULT_CACHE_DIR = Path.home() / ".WeixinMPTools" / "cover_cache"
+DEFAULT_CACHE_MB = 200      # 缓存图片的总大小上限 (MB)
+CACHE_MAX_AGE = 24 * 3600   # 记录在此时间（秒）内直接使用，不向服务器确认
+MAX_ARTICLES = 10000        # 最多保留的文章记录数
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class CacheEntry:
+    """一条缓存记录，value 为封面图地址（文章记录）或内容哈希（图片记录）"""
+    url: str
+    value: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+    size: int = 0
+
+    def is_fresh(self, max_age):
+        return time.time() - self.fetched_at < max_age
+
+    def conditional_headers(self):
+        """向服务器确认记录是否仍有效的请求头"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class CoverCache:
+    """封面图提取缓存，可在多个线程中共用"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024,
+                 max_age=CACHE_MAX_AGE):
+        self.cache_dir = Path(cache_dir)
+        self.blob_dir = self.cache_dir / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._save_locks = {}   # (内容哈希, 保存方式, 目录) -> 锁，同一图片同时保存时只写一次
+        self.conn = sqlite3.connect(str(self.cache_dir / "index.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS articles ("
+            " url TEXT PRIMARY KEY,"
+            " image_url TEXT NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " fetched_at REAL NOT NULL,"
+            " used_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS covers ("
+            " url TEXT PRIMARY KEY,"
+            " content_hash TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " fetched_at REAL NOT NULL,"
+            " used_at REAL NOT NULL)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(saved)")]
+        if columns and "variant" not in columns:
+            # 旧版本的记录不区分保存方式；这些记录只用于避免重复保存，直接重建
+            self.conn.execute("DROP TABLE saved")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS saved ("
+            " content_hash TEXT NOT NULL,"
+            " variant TEXT NOT NULL,"
+            " directory TEXT NOT NULL,"
+            " path TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " PRIMARY KEY (content_hash, variant, directory))"
+        )
+        self.conn.commit()
+
+    def blob_path(self, content_hash):
+        return self.blob_dir / content_hash
+
+    def article(self, url):
+        """文章的封面图地址记录，没有时返回 None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT image_url, etag, last_modified, fetched_at FROM articles WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE articles SET used_at = ? WHERE url = ?", (time.time(), url))
+            self.conn.commit()
+        return CacheEntry(url, *row)
+
+    def store_article(self, url, image_url, headers):
+        with self._lock:
+            now = time.time()
+            self.conn.execute("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?)",
+                              (url, image_url, headers.get('ETag'), headers.get('Last-Modified'), now, now))
+            self.conn.execute(
+                "DELETE FROM articles WHERE url IN ("
+                " SELECT url FROM articles ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (MAX_ARTICLES,))
+            self.conn.commit()
+
+    def cover(self, url):
+        """封面图的内容记录，没有记录或图片已被删除时返回 None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT content_hash, etag, last_modified, fetched_at, size FROM covers WHERE url = ?",
+                (url,)).fetchone()
+            if row is None or not self.blob_path(row[0]).is_file():
+                return None
+            self.conn.execute("UPDATE covers SET used_at = ? WHERE url = ?", (time.time(), url))
+            self.conn.commit()
+        return CacheEntry(url, *row)
+
+    def store_cover(self, url, chunks, headers):
+        """把响应内容写入缓存（边下载边计算哈希），返回新的记录"""
+        digest = hashlib.blake2b(digest_size=20)
+        # 临时文件名由 mkstemp 保证唯一，多个进程共用缓存目录时也不会冲突
+        fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=self.blob_dir)
+        temp_path = Path(temp_path)
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            content_hash = digest.hexdigest()
+            os.replace(temp_path, self.blob_path(content_hash))
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+
+        entry = CacheEntry(url, content_hash, headers.get('ETag'), headers.get('Last-Modified'), time.time(), size)
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO covers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (url, content_hash, size, entry.etag, entry.last_modified,
+                               entry.fetched_at, entry.fetched_at))
+            self.conn.commit()
+            self._evict()
+        return entry
+
+    def touch(self, entry, table):
+        """服务器确认记录仍有效（304），重新计算有效期；table 为 "articles" 或 "covers" """
+        with self._lock:
+            self.conn.execute(f"UPDATE {table} SET fetched_at = ? WHERE url = ?", (time.time(), entry.url))
+            self.conn.commit()
+
+    def save_copy(self, entry, output_dir, write, variant=""):
+        """把缓存的图片保存到 output_dir；该目录中已有以同样方式保存的相同图片时直接返回其路径
+
+        write(output_dir, chunks) 写入分块内容并返回保存路径。variant 区分保存方式，
+        原样复制为空字符串，压缩后保存时为压缩参数 (compress_index.settings_key)。
+        无论是否复用已有图片，都返回绝对路径。
+        """
+        directory = os.path.abspath(output_dir)
+        key = (entry.value, variant, directory)
+        with self._lock:
+            save_lock = self._save_locks.setdefault(key, threading.Lock())
+        # 多篇文章共用同一封面图时，后到的线程等待先到的写完后直接使用其结果
+        with save_lock:
+            with self._lock:
+                row = self.conn.execute(
+                    "SELECT path, size FROM saved WHERE content_hash = ? AND variant = ? AND directory = ?",
+                    key).fetchone()
+            if row is not None:
+                try:
+                    if os.path.getsize(row[0]) == row[1]:
+                        return row[0]
+                except OSError:
+                    pass
+
+            with open(self.blob_path(entry.value), 'rb') as blob:
+                path = os.path.abspath(write(output_dir, iter(lambda: blob.read(COPY_CHUNK_SIZE), b'')))
+            with self._lock:
+                self.conn.execute("INSERT OR REPLACE INTO saved VALUES (?, ?, ?, ?, ?)",
+                                  (*key, path, os.path.getsize(path)))
+                self.conn.commit()
+            return path
+
+    def _total_bytes(self):
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT content_hash, size FROM covers)").fetchone()[0]
+
+    def _evict(self):
+        """按最近使用时间淘汰图片，直到总大小不超过上限（调用时需持有锁）"""
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute(
+            "SELECT content_hash, MAX(size), MAX(used_at) AS last_used FROM covers"
+            " GROUP BY content_hash ORDER BY last_used").fetchall()
+        for content_hash, size, _ in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM covers WHERE content_hash = ?", (content_hash,))
+            try:
+                self.blob_path(content_hash).unlink()
+            except OSError:
+                pass
+            total -= size
+        self.conn.commit()
+
+    def clear(self):
+        """删除所有记录和缓存的图片（已保存到其他目录的图片不受影响）"""
+        with self._lock:
+            for table in ("articles", "covers", "saved"):
+                self.conn.execute(f"DELETE FROM {table}")
+            self.conn.commit()
+            for path in self.blob_dir.iterdir():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
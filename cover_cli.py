@@ -0,0 +1,100 @@
+"""公众号工具集 - 命令行批量提取封面图
+
+无需图形界面（不导入 tkinter）。参数可以是文章链接，也可以是包含链接的 txt/CSV 文件，
+"-" 表示从标准输入读取。每篇文章输出一行 JSON 结果，汇总信息输出到 stderr。
+
+用法示例:
+    python cover_cli.py links.txt -o ./covers --workers 8
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from cover_cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_MB, CoverCache
+from cover_extractor import DEFAULT_WORKERS, CoverJob, parse_article_urls, read_url_file, write_manifest
+from fetch_session import PER_HOST_LIMIT, FetchSession
+from image_compressor import CompressOptions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批量提取公众号文章封面图，逐行输出 JSON 结果")
+    parser.add_argument("inputs", nargs="+", help="文章链接、包含链接的 txt/CSV 文件，或 - 表示标准输入")
+    parser.add_argument("-o", "--output", default=".", help="封面图保存目录，默认当前目录")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"同时处理的文章数，默认 {DEFAULT_WORKERS}")
+    parser.add_argument("--per-host", type=int, default=PER_HOST_LIMIT,
+                        help=f"每个主机同时进行的请求数上限，默认 {PER_HOST_LIMIT}")
+    parser.add_argument("--no-http2", action="store_true", help="不使用 HTTP/2（需安装 httpx 和 h2 才会启用）")
+    parser.add_argument("--no-download", action="store_true", help="只提取封面图地址，不下载图片")
+    parser.add_argument("--compress", action="store_true",
+                        help="超过 --max-size 的封面图下载后直接在内存中压缩再保存")
+    parser.add_argument("-q", "--quality", type=int, default=80, help="压缩质量 10-100，默认 80")
+    parser.add_argument("-m", "--max-size", type=float, default=10, help="压缩后的最大文件大小 (MB)，默认 10")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR), help=f"缓存目录，默认 {DEFAULT_CACHE_DIR}")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_CACHE_MB, metavar="MB",
+                        help=f"缓存图片的总大小上限 (MB)，默认 {DEFAULT_CACHE_MB}")
+    parser.add_argument("--no-cache", action="store_true", help="不使用缓存，重新下载所有文章页和封面图")
+    parser.add_argument("--manifest", help="清单 (CSV) 路径，默认保存到输出目录的 manifest.csv")
+    return parser.parse_args(argv)
+
+
+def collect_urls(inputs):
+    """按参数顺序收集文章链接（去重）；直接给出的链接原样使用，不限主机（便于对接测试服务器）"""
+    urls = []
+    for item in inputs:
+        if item == "-":
+            urls.extend(parse_article_urls(sys.stdin.read()))
+        elif os.path.isfile(item):
+            urls.extend(read_url_file(item))
+        else:
+            urls.append(item)
+    return list(dict.fromkeys(urls))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    urls = collect_urls(args.inputs)
+    if not urls:
+        print("没有找到公众号文章链接", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+
+    cache = None if args.no_cache else CoverCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 * 1024))
+    with FetchSession(per_host=args.per_host, http2=not args.no_http2) as session:
+        if session.http2:
+            print("使用 HTTP/2", file=sys.stderr)
+        compress_options = CompressOptions(quality=args.quality, max_size_mb=args.max_size) if args.compress else None
+        job = CoverJob(urls, args.output, workers=args.workers, download=not args.no_download, session=session,
+                       cache=cache, compress_options=compress_options)
+        job.start()
+
+        state = None
+        while state is None:
+            try:
+                kind, payload = job.events.get()
+            except KeyboardInterrupt:
+                # Ctrl+C：不再处理新的链接，等待正在处理的链接结束
+                job.cancel()
+                continue
+            if kind == 'result':
+                print(json.dumps(payload.to_dict(), ensure_ascii=False), flush=True)
+            elif kind == 'done':
+                state = payload
+    if cache is not None:
+        cache.close()
+
+    manifest_path = args.manifest or os.path.join(args.output, "manifest.csv")
+    write_manifest(job.results, manifest_path)
+    succeeded = sum(1 for result in job.results if result.success)
+    print(f"{'完成' if state == 'finished' else '已取消'}: 共 {len(urls)} 个链接，"
+          f"成功 {succeeded}，失败 {len(job.results) - succeeded}，清单: {manifest_path}", file=sys.stderr)
+    if state != 'finished':
+        return 130
+    return 1 if succeeded < len(job.results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
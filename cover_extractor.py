@@ -0,0 +1,467 @@
+"""公众号工具集 - 公众号文章封面图提取
+
+不依赖 tkinter，图形界面 (WeixinMPTools) 与其他 Python 程序共用：
+
+    from cover_extractor import extract_cover
+    result = extract_cover("https://mp.weixin.qq.com/s/...", output_dir="covers")
+
+批量提取时用 CoverJob 在后台线程中并发请求，结果逐个通过 events 队列返回，
+结束后可用 write_manifest 导出清单。同一任务的请求共用一个 FetchSession，复用连接；
+指定 CoverCache 时重复提取同一篇文章不再重新下载文章页和封面图。
+封面图按实际格式保存（由文件头判断扩展名），指定 CompressOptions 时下载后直接在内存中压缩。
+"""
+
+import csv
+import io
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+from compress_index import settings_key
+from fetch_session import FetchSession
+from image_compressor import OUTPUT_EXTENSIONS, compress_image, write_atomic
+from stage_timer import NULL_TIMER, StageTimer
+
+
+DEFAULT_WORKERS = 8         # 批量提取时同时处理的文章数
+ARTICLE_URL_PATTERN = re.compile(r'https?://mp\.weixin\.qq\.com/[^\s,"\'<>]+')
+MSG_CDN_URL_PATTERN = re.compile(rb'var\s+msg_cdn_url\s*=\s*"([^"]+)"')
+OG_IMAGE_PATTERN = re.compile(rb'<meta property="og:image" content="(.*?)"')
+SCAN_CHUNK_SIZE = 16 * 1024 # 扫描文章页时每次读取的字节数，越小越能尽早停止读取
+SCAN_OVERLAP = 4096         # 保留上一块末尾的字节数，应大于一次匹配的最大长度，避免匹配跨块时漏掉
+OG_IMAGE_GRACE = 256 * 1024 # 先找到 og:image 时，再往后读取这么多字节寻找 msg_cdn_url
+DOWNLOAD_CHUNK_SIZE = 256 * 1024  # 下载封面图时每次读取的字节数
+MAX_COVER_MB = 20           # 封面图大小上限，超过时中止下载（公众号图片不超过 10MB）
+SNIFF_BYTES = 32            # 判断图片格式所需的文件头字节数
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+)
+WX_FMT_EXTENSIONS = {'jpeg': '.jpg', 'jpg': '.jpg', 'png': '.png', 'gif': '.gif', 'webp': '.webp', 'bmp': '.bmp'}
+MANIFEST_FIELDS = ["url", "status", "image_url", "path", "cached", "compressed", "seconds", "error"]
+
+
+def default_output_dir():
+    """封面图默认保存到桌面，没有桌面目录时保存到用户目录"""
+    desktop = Path.home() / "Desktop"
+    return str(desktop if desktop.exists() else Path.home())
+
+
+def parse_article_urls(text):
+    """从粘贴的文本或 CSV 内容中找出所有公众号文章链接（去重并保持顺序）"""
+    urls = []
+    seen = set()
+    for url in ARTICLE_URL_PATTERN.findall(text):
+        url = url.replace('&amp;', '&')
+        if url not in seen:
+            seen.add(url)
+            urls.append(url)
+    return urls
+
+
+def read_url_file(path):
+    """读取 txt/CSV 文件中的文章链接，兼容 UTF-8（含 BOM）与 GBK 编码"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    for encoding in ('utf-8-sig', 'gbk'):
+        try:
+            return parse_article_urls(data.decode(encoding))
+        except UnicodeDecodeError:
+            continue
+    return parse_article_urls(data.decode('utf-8', errors='ignore'))
+
+
+def scan_cover_url(chunks):
+    """逐块扫描文章页，找到封面图地址即停止读取，返回 (封面图地址或 None, 已读取字节数)
+
+    封面图地址在页面靠前的位置，不必下载和解码整个页面（常有几百 KB 的内联 JS/CSS）。
+    优先使用 JS 中的 msg_cdn_url；先遇到 meta og:image 时再往后读取 OG_IMAGE_GRACE 字节，
+    仍找不到 msg_cdn_url 则使用 og:image。
+    """
+    buffer = b''
+    scanned = 0
+    fallback = None
+    fallback_limit = None
+    for chunk in chunks:
+        scanned += len(chunk)
+        buffer += chunk
+        # 方法1：尝试匹配 JS 中的 msg_cdn_url
+        match = MSG_CDN_URL_PATTERN.search(buffer)
+        if match:
+            return match.group(1).decode('utf-8', errors='replace'), scanned
+        if fallback is None:
+            # 方法2：尝试匹配 meta og:image 标签
+            match = OG_IMAGE_PATTERN.search(buffer)
+            if match:
+                fallback = match.group(1).decode('utf-8', errors='replace')
+                fallback_limit = scanned + OG_IMAGE_GRACE
+        if fallback is not None and scanned >= fallback_limit:
+            break
+        buffer = buffer[-SCAN_OVERLAP:]
+    return fallback, scanned
+
+
+def create_unique_file(directory, stem, extension):
+    """新建目录中不存在的文件并以二进制写入方式打开，重名时依次追加 _1、_2…
+
+    以独占方式创建，多个线程同时下载时也不会写到同一个文件。返回 (文件对象, 路径)。
+    """
+    path = os.path.join(directory, stem + extension)
+    index = 1
+    while True:
+        try:
+            return open(path, 'xb'), path
+        except FileExistsError:
+            path = os.path.join(directory, f"{stem}_{index}{extension}")
+            index += 1
+
+
+def create_cover_file(output_dir, extension):
+    """新建 cover_YYYYMMDD_HHMMSS 加 extension 的文件，返回 (文件对象, 路径)"""
+    current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return create_unique_file(output_dir, f"cover_{current_time}", extension)
+
+
+def sniff_image_extension(head):
+    """按文件头判断图片格式，返回扩展名，无法识别时返回 None"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'avif', b'avis'):
+        return '.avif'
+    return None
+
+
+def image_extension(head, image_url, content_type):
+    """封面图的扩展名：优先按文件头判断；无法识别但服务器声明是图片时按地址中的 wx_fmt 参数"""
+    extension = sniff_image_extension(head)
+    if extension is None and content_type.startswith('image/'):
+        wx_fmt = parse_qs(urlsplit(image_url).query).get('wx_fmt', [''])[0].lower()
+        extension = WX_FMT_EXTENSIONS.get(wx_fmt)
+    if extension is None:
+        raise ValueError(f"下载的内容不是图片 ({content_type or '未知类型'})")
+    return extension
+
+
+def image_stream(response, image_url, max_bytes=MAX_COVER_MB * 1024 * 1024):
+    """检查封面图响应，返回 (扩展名, 分块迭代器)
+
+    先读取文件头判断格式，不是图片时立即中止；声明的或已读取的大小超过 max_bytes 时
+    抛出异常，不会把过大的内容写完。
+    """
+    too_large = f"封面图超过 {max_bytes / 1024 / 1024:g}MB"
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > max_bytes:
+        raise ValueError(too_large)
+    chunks = response.iter_bytes(DOWNLOAD_CHUNK_SIZE)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= SNIFF_BYTES:
+            break
+    extension = image_extension(head, image_url, response.headers.get('Content-Type', ''))
+
+    def validated():
+        total = len(head)
+        if total > max_bytes:
+            raise ValueError(too_large)
+        yield head
+        for chunk in chunks:
+            total += len(chunk)
+            if total > max_bytes:
+                raise ValueError(too_large)
+            yield chunk
+    return extension, validated()
+
+
+def write_cover(output_dir, extension, chunks):
+    """先写入同目录的隐藏临时文件，完整写完后再重命名为 cover_*，返回保存路径"""
+    temp_path = os.path.join(output_dir, f".cover_{os.getpid()}_{threading.get_ident()}.part")
+    path = None
+    try:
+        with open(temp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        # 独占创建占住文件名，再用临时文件原子替换
+        f, path = create_cover_file(output_dir, extension)
+        f.close()
+        os.replace(temp_path, path)
+        return path
+    except BaseException:
+        # 临时文件和占位的空文件都删除，失败时不留下 0 字节的封面图
+        for leftover in (temp_path, path):
+            if leftover is None:
+                continue
+            try:
+                os.remove(leftover)
+            except OSError:
+                pass
+        raise
+
+
+def save_cover(output_dir, extension, chunks, compress_options=None, timer=NULL_TIMER):
+    """保存封面图，返回 (保存路径, CompressResult 或 None)
+
+    指定 compress_options 且图片超过大小上限时，在内存中解码并压缩后再写入，
+    不先把原图写到磁盘；无法压缩到上限以内时抛出异常。
+    """
+    if compress_options is None:
+        return write_cover(output_dir, extension, chunks), None
+    data = b''.join(chunks)
+    if len(data) < compress_options.max_size_bytes:
+        return write_cover(output_dir, extension, [data]), None
+
+    with Image.open(io.BytesIO(data)) as img:
+        original_format = img.format
+        buffer, compressed = compress_image(img, compress_options, timer=timer)
+    if buffer is None:
+        raise ValueError(compressed.error)
+    if compressed.output_format != original_format:
+        extension = OUTPUT_EXTENSIONS[compressed.output_format]
+    f, path = create_cover_file(output_dir, extension)
+    f.close()
+    try:
+        with buffer, timer.stage("write") as stage:
+            write_atomic(path, buffer)
+            stage.bytes = compressed.output_bytes
+    except BaseException:
+        # 写入失败时删除占位的空文件
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    compressed.original_bytes, compressed.output_path = len(data), path
+    return path, compressed
+
+
+@dataclass
+class CoverResult:
+    """单篇文章的封面图提取结果"""
+    url: str
+    success: bool = False
+    image_url: Optional[str] = None
+    path: Optional[str] = None          # 下载后的本地路径
+    error: Optional[str] = None
+    cached: bool = False                # 封面图地址来自缓存，未下载文章页
+    compressed: bool = False            # 已按压缩参数压缩后保存
+    elapsed: float = 0.0                # 耗时（秒）
+    stages: list = field(default_factory=list)  # 各阶段耗时 (stage_timer.Stage)
+
+    @property
+    def status(self):
+        return "ok" if self.success else "failed"
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def find_article_cover(url, session, cache=None, timer=NULL_TIMER):
+    """返回 (封面图地址或 None, 是否来自缓存)
+
+    有缓存记录时先按有效期和 ETag/Last-Modified 确认；网络不通时使用缓存记录，
+    没有记录才抛出异常。
+    """
+    entry = cache.article(url) if cache is not None else None
+    if entry is not None and entry.is_fresh(cache.max_age):
+        return entry.value, True
+    try:
+        # 边下载边查找，找到后关闭连接，不再读取页面剩余部分
+        with timer.stage("fetch") as stage:
+            with session.stream(url, entry.conditional_headers() if entry else None) as response:
+                if entry is not None and response.status_code == 304:
+                    cache.touch(entry, "articles")
+                    return entry.value, True
+                response.raise_for_status()
+                image_url, stage.bytes = scan_cover_url(response.iter_bytes(SCAN_CHUNK_SIZE))
+    except Exception:
+        if entry is None:
+            raise
+        return entry.value, True
+    if cache is not None and image_url is not None:
+        cache.store_article(url, image_url, response.headers)
+    return image_url, False
+
+
+def download_image(image_url, output_dir, session, cache=None, compress_options=None, timer=NULL_TIMER):
+    """下载封面图到 output_dir，返回 (保存路径, 是否经过压缩)
+
+    使用缓存时图片先写入缓存，再复制或压缩到 output_dir；该目录已有以同样方式（原样或
+    同一组压缩参数）保存的相同图片时直接返回其路径，不重复压缩。
+    """
+    with timer.stage("download") as stage:
+        if cache is None:
+            with session.stream(image_url) as response:
+                response.raise_for_status()
+                extension, chunks = image_stream(response, image_url)
+                if compress_options is None:
+                    file_path = write_cover(output_dir, extension, chunks)
+                    stage.bytes = os.path.getsize(file_path)
+                    return file_path, False
+                data = b''.join(chunks)
+                stage.bytes = len(data)
+        else:
+            entry = cache.cover(image_url)
+            if entry is None or not entry.is_fresh(cache.max_age):
+                try:
+                    with session.stream(image_url, entry.conditional_headers() if entry else None) as response:
+                        if entry is not None and response.status_code == 304:
+                            cache.touch(entry, "covers")
+                        else:
+                            response.raise_for_status()
+                            _, chunks = image_stream(response, image_url)
+                            entry = cache.store_cover(image_url, chunks, response.headers)
+                            stage.bytes = entry.size
+                except ValueError:
+                    # 内容不是图片或超过大小上限
+                    raise
+                except Exception:
+                    # 网络不通时使用缓存的图片
+                    if entry is None:
+                        raise
+            with open(cache.blob_path(entry.value), 'rb') as blob:
+                extension = sniff_image_extension(blob.read(SNIFF_BYTES)) or '.jpg'
+            if compress_options is None or entry.size < compress_options.max_size_bytes:
+                return cache.save_copy(entry, output_dir,
+                                       lambda directory, chunks: write_cover(directory, extension, chunks)), False
+
+    if cache is not None:
+        # 压缩在下载计时之外单独记录各阶段
+        def compress(directory, chunks):
+            return save_cover(directory, extension, chunks, compress_options, timer)[0]
+        return cache.save_copy(entry, output_dir, compress, variant=settings_key(compress_options)), True
+    path, compressed = save_cover(output_dir, extension, [data], compress_options, timer)
+    return path, compressed is not None
+
+
+def extract_cover(url, output_dir=None, download=True, session=None, cache=None, compress_options=None):
+    """提取一篇文章的封面图地址，download 为 True 时同时下载，返回 CoverResult
+
+    多篇文章应共用同一个 session；未指定时临时建立一个，用完即关闭。
+    指定 compress_options (CompressOptions) 时，超过大小上限的封面图压缩后再保存。
+    """
+    if session is None:
+        with FetchSession() as session:
+            return extract_cover(url, output_dir, download, session, cache, compress_options)
+
+    result = CoverResult(url=url)
+    started = time.perf_counter()
+    timer = StageTimer()
+    try:
+        try:
+            result.image_url, result.cached = find_article_cover(url, session, cache, timer)
+        except Exception as e:
+            result.error = f"连接失败，请检查网络或网址是否正确: {e}"
+            return result
+
+        if result.image_url is None:
+            result.error = "未找到封面图链接，请确认是公众号文章页"
+            return result
+
+        if download:
+            try:
+                result.path, result.compressed = download_image(result.image_url, output_dir or default_output_dir(),
+                                                                session, cache, compress_options, timer)
+            except Exception as e:
+                result.error = f"下载图片时发生错误: {e}"
+                return result
+        result.success = True
+        return result
+    finally:
+        result.elapsed = time.perf_counter() - started
+        result.stages = timer.stages
+
+
+def write_manifest(results, path):
+    """把提取结果写成 CSV 清单（UTF-8 带 BOM，便于 Excel 直接打开）"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(MANIFEST_FIELDS)
+        for result in results:
+            writer.writerow([result.url, result.status, result.image_url or "", result.path or "",
+                             int(result.cached), int(result.compressed), f"{result.elapsed:.3f}", result.error or ""])
+
+
+class CoverJob:
+    """后台批量提取任务
+
+    在独立线程中用最多 workers 个线程并发提取，结果通过线程安全的 events 队列
+    交给界面线程。事件为 ('result', CoverResult) 或 ('done', 最终状态)。
+    正在执行的文章最多为 workers 个，取消时不再提交新的文章。
+    session 可由调用方提供并在多个任务间共用（任务结束时不关闭），
+    未提供时任务自建一个，结束时关闭。cache 为 CoverCache 时使用缓存；
+    compress_options 为 CompressOptions 时超过大小上限的封面图压缩后再保存。
+    """
+
+    def __init__(self, urls, output_dir=None, workers=DEFAULT_WORKERS, download=True, session=None, cache=None,
+                 compress_options=None):
+        self.urls = list(urls)
+        self.output_dir = output_dir or default_output_dir()
+        self.workers = max(1, workers)
+        self.download = download
+        self.session = session
+        self.cache = cache
+        self.compress_options = compress_options
+        self.results = []
+        self.events = queue.Queue()
+        self.state = "pending"  # pending / running / cancelling / finished / cancelled
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def is_active(self):
+        return self.state in ("pending", "running", "cancelling")
+
+    @property
+    def completed(self):
+        return len(self.results)
+
+    def start(self):
+        self.state = "running"
+        self._thread.start()
+
+    def cancel(self):
+        if self.state == "running":
+            self.state = "cancelling"
+            self._cancel_event.set()
+
+    def _run(self):
+        remaining = iter(self.urls)
+        pending = set()
+        session = self.session or FetchSession()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while True:
+                    while not self._cancel_event.is_set() and len(pending) < self.workers:
+                        url = next(remaining, None)
+                        if url is None:
+                            break
+                        pending.add(executor.submit(extract_cover, url, self.output_dir, self.download, session,
+                                                     self.cache, self.compress_options))
+                    if not pending:
+                        break
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        result = future.result()
+                        self.results.append(result)
+                        self.events.put(('result', result))
+        finally:
+            if self.session is None:
+                session.close()
+            self.state = "cancelled" if self._cancel_event.is_set() else "finished"
+            self.events.put(('done', self.state))
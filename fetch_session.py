@@ -0,0 +1,124 @@
+"""公众号工具集 - 共用的 HTTP 连接
+
+封面图提取的所有请求（文章页、封面图）共用一个 FetchSession：同一主机的连接保持复用
+（keep-alive），不再每个请求都重新建立 TCP/TLS 连接；每个主机同时进行的请求数有上限。
+安装了 httpx 和 h2 时使用 HTTP/2，同一连接上可并发多个请求；否则使用 requests 的连接池。
+线程安全，可在多个线程中同时使用。不依赖 tkinter。
+"""
+
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # httpx 为可选依赖
+    httpx = None
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+except ImportError:
+    h2 = None
+
+HTTPX_AVAILABLE = httpx is not None
+HTTP2_AVAILABLE = HTTPX_AVAILABLE and h2 is not None
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/120.0 Safari/537.36')
+REQUEST_TIMEOUT = 10        # 单次请求超时（秒）
+PER_HOST_LIMIT = 8          # 每个主机同时进行的请求数上限（也是每个主机保留的空闲连接数）
+POOL_HOSTS = 16             # 连接池最多保留的主机数
+CHUNK_SIZE = 64 * 1024      # 流式读取时每次读取的字节数
+
+
+class FetchError(Exception):
+    """服务器返回了错误状态码"""
+
+    def __init__(self, status_code):
+        super().__init__(f"服务器返回错误: {status_code}")
+        self.status_code = status_code
+
+
+class FetchResponse:
+    """流式响应，统一 requests 与 httpx 的接口"""
+
+    def __init__(self, url, status_code, headers, iter_bytes):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers  # 不区分大小写
+        self._iter_bytes = iter_bytes
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise FetchError(self.status_code)
+
+    def iter_bytes(self, chunk_size=CHUNK_SIZE):
+        return self._iter_bytes(chunk_size)
+
+    def read(self):
+        return b''.join(self.iter_bytes())
+
+
+class FetchSession:
+    """保持连接复用的 HTTP 会话，可在多个线程中共用
+
+    用法：
+        with FetchSession() as session:
+            with session.stream(url) as response:
+                response.raise_for_status()
+                data = response.read()
+    """
+
+    def __init__(self, per_host=PER_HOST_LIMIT, timeout=REQUEST_TIMEOUT, http2=True):
+        self.per_host = max(1, per_host)
+        self.timeout = timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        headers = {'User-Agent': USER_AGENT}
+        if HTTPX_AVAILABLE:
+            self._client = httpx.Client(http2=self.http2, headers=headers, timeout=timeout, follow_redirects=True,
+                                        limits=httpx.Limits(max_keepalive_connections=POOL_HOSTS * self.per_host))
+        else:
+            self._client = requests.Session()
+            self._client.headers.update(headers)
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=self.per_host)
+            self._client.mount('http://', adapter)
+            self._client.mount('https://', adapter)
+
+    def host_limit(self, url):
+        """该主机的并发信号量"""
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            limit = self._host_limits.get(host)
+            if limit is None:
+                limit = self._host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return limit
+
+    @contextmanager
+    def stream(self, url, headers=None):
+        """发起 GET 请求，响应体按需读取；提前退出时关闭连接，不再读取剩余内容"""
+        with self.host_limit(url):
+            if HTTPX_AVAILABLE:
+                with self._client.stream('GET', url, headers=headers) as response:
+                    yield FetchResponse(str(response.url), response.status_code, response.headers,
+                                        response.iter_bytes)
+            else:
+                response = self._client.get(url, headers=headers, stream=True, timeout=self.timeout)
+                try:
+                    yield FetchResponse(response.url, response.status_code, response.headers,
+                                        response.iter_content)
+                finally:
+                    response.close()
+
+    def close(self):
+        self._client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
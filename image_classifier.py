@@ -0,0 +1,92 @@
+"""公众号工具集 - 图片内容分类
+
+在缩小的采样图上统计颜色数、大面积纯色占比、边缘密度和透明度，把图片粗分为
+照片、截图、文字图三类。不同类型的 体积-质量、体积-像素 曲线差别很大，压缩引擎
+按类型选择搜索的先验参数，以及自动策略下 PNG/GIF 的输出格式。不依赖 tkinter。
+"""
+
+from dataclasses import dataclass
+
+from PIL import Image, ImageFilter
+
+
+SAMPLE_SIZE = 128           # 采样图的最长边（最近邻采样，保留原有颜色，不产生过渡色）
+FLAT_TOP_COLORS = 32        # 统计出现最多的 32 种颜色所占的像素比例
+FLAT_RATIO = 0.5            # 超过一半像素属于少数几种颜色即视为截图/图形
+TEXT_EDGE_DENSITY = 0.3     # 边缘像素占比超过 30% 的平面图视为文字图
+PALETTE_COLORS = 256        # 采样图颜色不超过 256 种才适合调色板 PNG（文字图也以此为前提）
+EDGE_THRESHOLD = 48         # 边缘强度（0-255）超过该值才计为边缘像素
+MAX_COUNTED_COLORS = 4096   # 颜色数超过该值时不再精确统计
+
+
+@dataclass(frozen=True)
+class ContentPreset:
+    """一类图片的压缩参数"""
+    name: str
+    label: str
+    log_slope: float        # 质量每降 1，ln(体积) 的先验下降量
+    pixel_exponent: float   # 体积 ∝ 像素数^k 的先验指数
+    prefer_palette: bool    # 颜色不超过 PALETTE_COLORS 时，自动策略下保持 PNG（调色板）而不转 JPEG
+
+
+# 斜率与指数取自基准语料实测：照片体积随质量下降快、随尺寸近似线性变化；
+# 截图大面积纯色，降低质量收益小，缩小尺寸收益也小
+PRESETS = {
+    "photo": ContentPreset("photo", "照片", log_slope=0.03, pixel_exponent=0.9, prefer_palette=False),
+    "screenshot": ContentPreset("screenshot", "截图", log_slope=0.012, pixel_exponent=0.7, prefer_palette=True),
+    "text": ContentPreset("text", "文字图", log_slope=0.015, pixel_exponent=0.8, prefer_palette=True),
+}
+
+
+@dataclass
+class ContentStats:
+    """采样图上的统计量"""
+    colors: int             # 颜色数，超过 MAX_COUNTED_COLORS 时为 MAX_COUNTED_COLORS + 1
+    flat_ratio: float       # 出现最多的 FLAT_TOP_COLORS 种颜色所占像素比例
+    edge_density: float     # 边缘像素比例
+    alpha: bool             # 是否有不完全不透明的像素
+
+
+def sample_image(img):
+    """最近邻缩小到最长边 SAMPLE_SIZE，只读取很少的像素"""
+    scale = SAMPLE_SIZE / max(img.size)
+    if scale < 1:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.NEAREST)
+    return img.convert('RGBA' if img.has_transparency_data else 'RGB')
+
+
+def content_stats(img):
+    """计算图片的内容统计量"""
+    sample = sample_image(img)
+    pixels = sample.width * sample.height
+    colors = sample.getcolors(MAX_COUNTED_COLORS)
+    if colors is None:
+        color_count, flat_ratio = MAX_COUNTED_COLORS + 1, 0.0
+    else:
+        counts = sorted((count for count, _ in colors), reverse=True)
+        color_count, flat_ratio = len(counts), sum(counts[:FLAT_TOP_COLORS]) / pixels
+    edges = sample.convert('L').filter(ImageFilter.FIND_EDGES)
+    histogram = edges.histogram()
+    edge_density = sum(histogram[EDGE_THRESHOLD:]) / pixels
+    alpha = sample.mode == 'RGBA' and sample.getchannel('A').getextrema()[0] < 255
+    return ContentStats(color_count, flat_ratio, edge_density, alpha)
+
+
+def classify_stats(stats):
+    """按统计量返回 PRESETS 中的类型名"""
+    if stats.flat_ratio < FLAT_RATIO:
+        return "photo"
+    if stats.colors <= PALETTE_COLORS and stats.edge_density >= TEXT_EDGE_DENSITY:
+        return "text"
+    return "screenshot"
+
+
+def classify_image(img):
+    """返回 (ContentPreset, ContentStats)"""
+    stats = content_stats(img)
+    return PRESETS[classify_stats(stats)], stats
+
+
+def prefers_palette(preset, stats):
+    """是否适合输出 PNG：颜色足够少的平面图，或带透明度的平面图（转 JPEG 会丢失透明度）"""
+    return preset.prefer_palette and (stats.colors <= PALETTE_COLORS or stats.alpha)
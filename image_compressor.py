@@ -0,0 +1,1256 @@
+"""公众号工具集 - 图片压缩引擎
+
+不依赖 tkinter，图形界面 (WeixinMPTools) 与命令行 (compress_cli.py) 共用，
+也可以直接在其他 Python 程序中调用：
+
+    from image_compressor import CompressOptions, compress_file
+    result = compress_file("photo.jpg", options=CompressOptions(quality=80, max_size_mb=5))
+"""
+
+import io
+import math
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, asdict, field, replace
+from typing import Optional, Tuple
+
+from PIL import Image, ImageChops, ImageStat, features
+
+from compress_index import CompressionIndex, file_hash
+from image_classifier import classify_image, prefers_palette
+from image_metrics import SSIM_AVAILABLE, SimilarityReference
+from stage_timer import NULL_TIMER, StageTimer
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+OUTPUT_NAME_PATTERN = re.compile(r'_compressed_q\d+$')  # 压缩结果的文件名后缀，批量扫描时排除
+CONVERT_FORMATS = {"auto": "JPEG", "webp": "WEBP", "avif": "AVIF"}  # PNG/GIF 按策略转换的目标格式，keep 保持原格式
+OUTPUT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "AVIF": ".avif"}  # 格式变化时输出文件的扩展名
+SCAN_QUEUE_SIZE = 1000      # 扫描线程领先压缩进度的最大文件数
+MIN_QUALITY = 15            # 质量搜索下限（与旧版 5 步递减的最低值一致）
+SEARCH_MAX_ENCODES = 6      # 单次质量搜索最多编码次数
+SEARCH_FILL_RATIO = 0.9     # 输出达到上限的 90% 即视为命中目标，提前结束搜索
+AVIF_SPEED = 8              # AVIF 编码速度 (0-10)，默认的 6 在大图上要数秒，搜索需要多次编码
+PARALLEL_SEARCH_ROUNDS = 3  # 多线程质量搜索最多进行的轮数
+SSIM_MAX_ENCODES = 5        # 按相似度下限继续降低质量时最多编码次数
+SSIM_QUALITY_STEP = 2       # 达标与不达标的质量相差不超过 2 时停止
+DEFAULT_LOG_SLOPE = 0.025   # 先验模型：质量每降 1，ln(体积) 约下降 0.025
+DEFAULT_PIXEL_EXPONENT = 0.85  # 先验模型：体积 ∝ 像素数^0.85（缩小后单位像素细节更多）
+DOWNSCALE_SAFETY = 0.97     # 预测缩放比例时额外留出的余量
+DOWNSCALE_MAX_ENCODES = 6   # 缩小尺寸时最多编码次数，用完后返回已找到的最大可用尺寸
+MIN_DIMENSION = 100         # 缩放后的最短边下限
+RESIZE_MIN_QUALITY = 70     # 需要缩小尺寸时使用的最低质量
+DRAFT_MIN_PIXELS = 8_000_000  # 只对 800 万像素以上的 JPEG 尝试草稿解码
+DRAFT_PROBE_SCALE = 8       # 预估体积时按 1/8 草稿解码
+DRAFT_CERTAINTY = 1.5       # 估算的最低质量体积超过上限 1.5 倍才认定必须缩小
+DRAFT_HEADROOM = 1.25       # 草稿解码的目标像素数比预测值多留 25%，预测偏小时仍能向上微调
+FILE_MEMORY_OVERHEAD = 16 * 1024 * 1024     # 估算单个文件内存时额外预留的字节数
+WORKER_BASE_MEMORY = 48 * 1024 * 1024       # 每个工作进程自身（解释器、Pillow）占用的内存
+QUALITY_FORMATS = ('JPEG', 'MPO', 'WEBP', 'AVIF')  # 体积随 quality 变化的格式，其余格式不做质量搜索（MPO 为相机拍摄的 JPEG）
+PNG_PALETTE_STEPS = (256, 128, 64, 32)      # 无损 PNG 超限时依次尝试的调色板颜色数
+PNG_PALETTE_REACH = 1.5     # 量化后仍超上限 1.5 倍时，不再尝试更少的颜色而直接缩小尺寸
+PNG_STRATEGY_ROWS = 256     # 选择 zlib 策略时从图片中部截取试编码的行数
+PNG_COMPRESS_TYPES = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE)  # 候选 zlib 策略
+GIF_PALETTE_SAMPLES = 8     # 生成动图共用调色板时均匀抽取的帧数
+GIF_PALETTE_SAMPLE_SIZE = 128  # 抽取的帧最近邻缩小到该最长边后拼在一起量化
+FRAME_PALETTE_MAX_ERROR = 6 # 帧用共用调色板的平均误差（每通道 0-255）超过该值时，试用本帧自己的调色板
+FRAME_PALETTE_GAIN = 2      # 本帧调色板的误差不到共用调色板的一半时才采用（颜色数太少时两者都不准，仍用共用的）
+
+
+def encode_image(img, output_format, quality, timer=NULL_TIMER):
+    """按指定质量编码到内存，返回 BytesIO"""
+    params = {'quality': quality, 'optimize': True}
+    if output_format == 'WEBP':
+        # WebP 的透明通道默认无损压缩，体积不随 quality 变化
+        params['alpha_quality'] = quality
+    elif output_format == 'AVIF':
+        params['speed'] = AVIF_SPEED
+    with timer.stage("encode") as stage:
+        buffer = io.BytesIO()
+        img.save(buffer, format=output_format, **params)
+        stage.bytes = buffer.tell()
+    return buffer
+
+
+def reduce_alpha(img):
+    """透明通道全不透明时直接去掉；完全透明像素的颜色清零，使其便于压缩"""
+    if img.mode not in ('RGBA', 'LA'):
+        return img
+    alpha = img.getchannel('A')
+    low, high = alpha.getextrema()
+    if low == 255:
+        return img.convert(img.mode[:-1])
+    if low == 0:
+        hidden = alpha.point(lambda a: 255 if a == 0 else 0)
+        img = img.copy()
+        img.paste((0,) * len(img.getbands()), mask=hidden)
+    return img
+
+
+def choose_png_compress_type(img):
+    """截取图片中部一段试编码，返回体积最小的 zlib 策略
+
+    Pillow 对每行自适应选择 PNG 滤波器，可调的只有 zlib 策略：照片类图片
+    通常 Z_FILTERED 更小，大面积纯色的截图通常 Z_RLE 更小。
+    """
+    top = max(img.height // 2 - PNG_STRATEGY_ROWS // 2, 0)
+    sample = img.crop((0, top, img.width, min(top + PNG_STRATEGY_ROWS, img.height)))
+    best_type, best_size = None, None
+    for compress_type in PNG_COMPRESS_TYPES:
+        buffer = io.BytesIO()
+        sample.save(buffer, format='PNG', compress_level=6, compress_type=compress_type)
+        if best_size is None or buffer.tell() < best_size:
+            best_type, best_size = compress_type, buffer.tell()
+    return best_type
+
+
+def encode_png(img, colors=None, compress_type=zlib.Z_DEFAULT_STRATEGY, timer=NULL_TIMER):
+    """编码 PNG 到内存，colors 不为空时先量化为对应颜色数的调色板图"""
+    if colors:
+        # 有 libimagequant 时用它（画质最好），否则用支持透明度的快速八叉树
+        method = Image.Quantize.LIBIMAGEQUANT if features.check('libimagequant') else Image.Quantize.FASTOCTREE
+        with timer.stage("quantize") as stage:
+            img = img.quantize(colors, method=method)
+            stage.bytes = img.width * img.height
+    with timer.stage("encode") as stage:
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG', optimize=True, compress_type=compress_type)
+        stage.bytes = buffer.tell()
+    return buffer
+
+
+def make_palette(rgb, colors, transparent):
+    """由 RGB 图生成 colors 色的调色板图；transparent 时最后一个索引留给透明色"""
+    palette = rgb.quantize(colors - transparent, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    if transparent:
+        palette.putpalette(palette.getpalette()[:3 * (colors - 1)] + [0, 0, 0])
+    return palette
+
+
+def build_frame_palette(img, size=None, colors=256):
+    """从动图中均匀抽取最多 GIF_PALETTE_SAMPLES 帧生成共用调色板，之后出现的新颜色也能覆盖"""
+    count = getattr(img, 'n_frames', 1)
+    indices = sorted({round(i * (count - 1) / max(GIF_PALETTE_SAMPLES - 1, 1))
+                      for i in range(min(count, GIF_PALETTE_SAMPLES))})
+    samples = []
+    try:
+        for index in indices:
+            img.seek(index)
+            frame = img.convert('RGB')
+            if size and frame.size != size:
+                frame = frame.resize(size, Image.NEAREST)
+            scale = GIF_PALETTE_SAMPLE_SIZE / max(frame.size)
+            if scale < 1:
+                frame = frame.resize((max(1, round(frame.width * scale)), max(1, round(frame.height * scale))),
+                                     Image.NEAREST)
+            samples.append(frame)
+    finally:
+        img.seek(0)
+    montage = Image.new('RGB', (max(frame.width for frame in samples), sum(frame.height for frame in samples)))
+    top = 0
+    for frame in samples:
+        montage.paste(frame, (0, top))
+        top += frame.height
+    return make_palette(montage, colors, img.has_transparency_data)
+
+
+def quantize_frame(frame, palette, colors=256):
+    """把帧量化为调色板图
+
+    各帧使用同一个 palette，使未变化的区域映射到相同的索引，GIF 编码器才能只保存
+    变化的部分，不抖动也是为了这一点。共用调色板覆盖不了本帧的颜色（平均误差超过
+    FRAME_PALETTE_MAX_ERROR，且本帧自己的调色板明显更准）时改用本帧自己的调色板
+    （GIF 局部颜色表）。
+    透明像素（alpha < 128）统一使用最后一个索引。
+    """
+    transparent = frame.mode == 'RGBA'
+    rgb = frame.convert('RGB')
+    opaque = frame.getchannel('A').point(lambda a: 255 if a >= 128 else 0) if transparent else None
+
+    def quantize_with(palette):
+        quantized = rgb.quantize(palette=palette, dither=Image.Dither.NONE)
+        error = ImageStat.Stat(ImageChops.difference(rgb, quantized.convert('RGB')), opaque).mean
+        return quantized, sum(error) / 3
+
+    quantized, error = quantize_with(palette)
+    if error > FRAME_PALETTE_MAX_ERROR:
+        local_palette = make_palette(rgb, colors, transparent)
+        local, local_error = quantize_with(local_palette)
+        if local_error * FRAME_PALETTE_GAIN < error:
+            quantized, palette = local, local_palette
+    if transparent:
+        index = len(palette.getpalette()) // 3 - 1
+        quantized.paste(index, mask=frame.getchannel('A').point(lambda a: 255 if a < 128 else 0))
+        quantized.info['transparency'] = index
+    return quantized
+
+
+def iter_frames(img, size=None, colors=None, merge=True):
+    """逐帧产出动图的画面（不一次性解码全部帧），连续的相同帧合并为一帧
+
+    帧按需缩放到 size；给出 colors 时全部帧量化到抽样生成的同一个调色板（见 quantize_frame）。
+    合并后的时长写入 frame.info['duration']，结束后 img 回到第一帧。merge 为 False 时
+    不合并，产出的帧与 frame_durations 的时长一一对应。
+    """
+    pending, pending_raw = None, None
+    palette = build_frame_palette(img, size, colors) if colors else None
+    try:
+        for index in range(getattr(img, 'n_frames', 1)):
+            img.seek(index)
+            raw = img.convert('RGBA' if img.has_transparency_data else 'RGB')
+            if size and raw.size != size:
+                raw = raw.resize(size, Image.LANCZOS)
+            duration = img.info.get('duration', 0)
+            if (merge and pending_raw is not None and raw.mode == pending_raw.mode
+                    and ImageChops.difference(raw, pending_raw).getbbox(alpha_only=False) is None):
+                pending.info['duration'] += duration
+                continue
+            if pending is not None:
+                yield pending
+            if colors:
+                pending = quantize_frame(raw, palette, colors)
+            else:
+                pending = raw.copy()
+            pending.info['duration'] = duration
+            pending_raw = raw
+        if pending is not None:
+            yield pending
+    finally:
+        img.seek(0)
+
+
+def frame_durations(img):
+    """读取每一帧的时长（毫秒）"""
+    durations = []
+    try:
+        for index in range(getattr(img, 'n_frames', 1)):
+            img.seek(index)
+            durations.append(img.info.get('duration', 0))
+    finally:
+        img.seek(0)
+    return durations
+
+
+def encode_animation(img, output_format, quality, size=None, colors=None, durations=None, timer=NULL_TIMER):
+    """把 GIF（含动图）逐帧编码为 GIF 或动态 WebP/AVIF，返回 BytesIO
+
+    GIF 与缩小尺寸的 WebP/AVIF 由 iter_frames 逐帧产出，但 Pillow 的 GIF、WebP/AVIF
+    编码器会先收集全部帧再写入，内存随帧数增长（estimate_memory 按帧数估算）。
+    原尺寸的 WebP/AVIF 直接把 img 交给 Pillow 逐帧读取（durations 为各帧时长），
+    不保留各帧。
+    """
+    params = {'loop': img.info['loop']} if 'loop' in img.info else {}
+    if output_format == 'WEBP':
+        params.update(quality=quality, alpha_quality=quality)
+    elif output_format == 'AVIF':
+        params.update(quality=quality, speed=AVIF_SPEED)
+    with timer.stage("encode") as stage:
+        buffer = io.BytesIO()
+        if output_format == 'GIF':
+            frames = iter_frames(img, size, colors or PNG_PALETTE_STEPS[0])
+            first = next(frames)
+            # 带透明度的帧需要先清除上一帧，否则透明区域会露出旧画面
+            disposal = 2 if 'transparency' in first.info else 1
+            first.save(buffer, format='GIF', save_all=True, append_images=frames, optimize=True,
+                       disposal=disposal, **params)
+        elif size is None:
+            img.save(buffer, format=output_format, save_all=True, duration=durations, **params)
+        else:
+            frames = iter_frames(img, size, merge=False)
+            first = next(frames)
+            first.save(buffer, format=output_format, save_all=True, append_images=frames,
+                       duration=durations, **params)
+        stage.bytes = buffer.tell()
+    return buffer
+
+
+def search_quality(img, output_format, max_quality, max_size_bytes, min_quality=MIN_QUALITY, samples=None,
+                   timer=NULL_TIMER, encode=encode_image, log_slope=DEFAULT_LOG_SLOPE):
+    """在 [min_quality, max_quality] 内搜索不超过 max_size_bytes 的最高质量
+
+    首次按 max_quality 编码；之后用 ln(体积)-质量 的线性模型（先验斜率，
+    有两个样本后改用割线）预测下一个质量，落在区间外时退化为二分。
+    传入 samples 列表时会追加每次试编码的 (质量, 字节数)。
+    encode 与 encode_image 参数相同，可替换编码方式；log_slope 为先验斜率。
+    返回 (buffer, quality, encodes)，无法满足时 buffer 为 None。
+    """
+    target = max_size_bytes * (1 + SEARCH_FILL_RATIO) / 2  # 瞄准区间 [90%, 100%] 的中点
+    encodes = 0
+    best_buffer, best_quality = None, None
+    fit_point = None    # (质量, ln体积)，已知满足上限的最高质量
+    over_point = None   # (质量, ln体积)，已知超出上限的最低质量
+    last_point = None
+    q = max_quality
+
+    try:
+        while encodes < SEARCH_MAX_ENCODES:
+            buffer = encode(img, output_format, q, timer)
+            encodes += 1
+            size = buffer.tell()
+            point = (q, math.log(max(size, 1)))
+            if samples is not None:
+                samples.append((q, size))
+
+            if size <= max_size_bytes:
+                if best_buffer is not None:
+                    best_buffer.close()
+                best_buffer, best_quality = buffer, q
+                fit_point = point
+                if q == max_quality or size >= max_size_bytes * SEARCH_FILL_RATIO:
+                    break
+            else:
+                buffer.close()
+                if last_point is not None and last_point[1] == point[1]:
+                    # 体积与质量无关（如 PNG/BMP），继续搜索没有意义
+                    break
+                over_point = point
+                if q == min_quality:
+                    break
+
+            lo = fit_point[0] if fit_point else min_quality - 1
+            hi = over_point[0]
+            if hi - lo <= 1:
+                break
+
+            # 用模型预测命中目标体积的质量
+            if fit_point and over_point:
+                (qa, la), (qb, lb) = fit_point, over_point
+            elif last_point is not None and last_point[0] != q:
+                (qa, la), (qb, lb) = last_point, point
+            else:
+                (qa, la), (qb, lb) = (q - 1, point[1] - log_slope), point
+            slope = (lb - la) / (qb - qa)
+            if slope > 1e-6:
+                predicted = int(round(qb + (math.log(target) - lb) / slope))
+            else:
+                predicted = (lo + hi) // 2
+            # 限制在区间内部，否则退化为二分
+            if predicted >= hi or (predicted <= lo and fit_point):
+                predicted = (lo + hi) // 2
+            last_point = point
+            q = max(min_quality, min(predicted, hi - 1))
+    except Exception:
+        if best_buffer is not None:
+            best_buffer.close()
+        raise
+
+    return best_buffer, best_quality if best_buffer is not None else max_quality, encodes
+
+
+def spread_qualities(low, high, count):
+    """在 [low, high] 内均匀取最多 count 个质量（包含 high），从高到低排列"""
+    if high - low + 1 <= count:
+        return list(range(high, low - 1, -1))
+    step = (high - low) / max(count - 1, 1)
+    return sorted({int(round(high - i * step)) for i in range(count)}, reverse=True)
+
+
+def parallel_search_quality(img, output_format, max_quality, max_size_bytes, threads, min_quality=MIN_QUALITY,
+                            samples=None, timer=NULL_TIMER, log_slope=DEFAULT_LOG_SLOPE):
+    """search_quality 的多线程版本，用于降低单张大图的等待时间
+
+    Pillow 编码时会释放 GIL，因此每轮用 threads 个线程同时编码多个候选质量：
+    第一轮在 [min_quality, max_quality] 内均匀取点，之后在已知满足与超限的质量之间
+    按 ln(体积)-质量 插值，在预测值两侧密集取点。编码次数通常多于串行搜索，但轮数更少。
+    返回值与 search_quality 相同。
+    """
+    min_quality = min(min_quality, max_quality)
+    target = max_size_bytes * (1 + SEARCH_FILL_RATIO) / 2
+    sizes = {}                      # 质量 -> 字节数
+    fit_q, over_q = None, None      # 已知满足上限的最高质量、已知超限的最低质量
+    best_buffer = None
+    encodes = 0
+    candidates = spread_qualities(min_quality, max_quality, threads)
+
+    # Image.save 会把参数写在图片对象上（encoderinfo），不能在多个线程中同时保存同一个对象：
+    # 每个线程第一次编码时复制一份，之后各轮复用，共 threads 份副本
+    img.load()
+    local = threading.local()
+
+    def encode(q):
+        if not hasattr(local, 'img'):
+            local.img = img.copy()
+        return encode_image(local.img, output_format, q, timer)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        try:
+            for _ in range(PARALLEL_SEARCH_ROUNDS):
+                futures = [(q, executor.submit(encode, q)) for q in candidates]
+                for q, future in futures:
+                    buffer = future.result()
+                    encodes += 1
+                    sizes[q] = buffer.tell()
+                    if samples is not None:
+                        samples.append((q, sizes[q]))
+                    if sizes[q] <= max_size_bytes and (fit_q is None or q > fit_q):
+                        if best_buffer is not None:
+                            best_buffer.close()
+                        best_buffer, fit_q = buffer, q
+                    else:
+                        buffer.close()
+                        if sizes[q] > max_size_bytes and (over_q is None or q < over_q):
+                            over_q = q
+
+                if fit_q == max_quality or (fit_q is not None and sizes[fit_q] >= max_size_bytes * SEARCH_FILL_RATIO):
+                    break
+                if over_q == min_quality or (len(sizes) > 1 and len(set(sizes.values())) == 1):
+                    # 最低质量仍超限，或体积与质量无关（如 PNG/BMP）
+                    break
+                lo = fit_q if fit_q is not None else min_quality - 1
+                if over_q - lo <= 1:
+                    break
+
+                # 用最接近区间两端的样本预测命中目标体积的质量
+                if fit_q is not None:
+                    (qa, sa), (qb, sb) = (fit_q, sizes[fit_q]), (over_q, sizes[over_q])
+                    slope = (math.log(sb) - math.log(sa)) / (qb - qa)
+                else:
+                    qa, sa = over_q, sizes[over_q]
+                    slope = log_slope
+                predicted = qa + (math.log(target) - math.log(sa)) / slope if slope > 1e-6 else (lo + over_q) / 2
+                predicted = min(max(int(round(predicted)), lo + 1), over_q - 1)
+                # 预测值优先，其余线程在它两侧交替补点，区间越宽步长越大
+                step = max(1, (over_q - lo) // (threads * 2))
+                candidates = [predicted]
+                for offset in range(1, over_q - lo):
+                    for q in (predicted + offset * step, predicted - offset * step):
+                        if lo < q < over_q and len(candidates) < threads:
+                            candidates.append(q)
+        except Exception:
+            if best_buffer is not None:
+                best_buffer.close()
+            raise
+
+    return best_buffer, fit_q if best_buffer is not None else max_quality, encodes
+
+
+def lower_to_similarity(img, output_format, quality, buffer, score, reference, min_ssim, min_quality=MIN_QUALITY,
+                        timer=NULL_TIMER):
+    """从满足大小上限的 quality 向下二分，找出 SSIM 仍不低于 min_ssim 的最低质量
+
+    buffer 为 quality 下的编码结果，score 为其 SSIM（调用方已确认达标）。
+    返回 (buffer, quality, score, encodes)，即相似度达标的最小输出。
+    """
+    lo, hi = min_quality - 1, quality  # lo 以下视为不达标，hi 为已知达标的最低质量
+    encodes = 0
+    try:
+        while hi - lo > SSIM_QUALITY_STEP and encodes < SSIM_MAX_ENCODES:
+            q = (lo + hi) // 2
+            candidate = encode_image(img, output_format, q, timer)
+            encodes += 1
+            with timer.stage("ssim"):
+                candidate_score = reference.score(candidate)
+            if candidate_score >= min_ssim:
+                buffer.close()
+                buffer, hi, score = candidate, q, candidate_score
+            else:
+                candidate.close()
+                lo = q
+    except Exception:
+        buffer.close()
+        raise
+    return buffer, hi, score, encodes
+
+
+def compress_png(img, max_size_bytes, timer=NULL_TIMER):
+    """保持 PNG 格式的压缩：无损重编码 → 调色板量化 → 缩小尺寸
+
+    PNG 体积与 quality 无关，不做质量搜索。先去掉无用的透明信息、选出 zlib
+    策略做一次无损编码；仍超限时依次减少调色板颜色数，差距太大时改为在
+    256 色下按比例缩小尺寸。返回 (buffer, (宽, 高), colors, encodes)，
+    colors 为 None 表示无损输出，失败时 buffer 为 None。
+    """
+    img = reduce_alpha(img)
+    compress_type = choose_png_compress_type(img)
+    buffer = encode_png(img, compress_type=compress_type, timer=timer)
+    encodes = 1
+    if buffer.tell() <= max_size_bytes:
+        return buffer, img.size, None, encodes
+    base_size = buffer.tell()
+    buffer.close()
+
+    # 调色板图、灰度图先转为真彩色再量化，颜色数本就不多时跳过不会变小的档位
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if img.has_transparency_data else 'RGB')
+    existing_colors = len(img.getcolors(PNG_PALETTE_STEPS[0]) or ())
+    for colors in PNG_PALETTE_STEPS:
+        if existing_colors and colors >= existing_colors:
+            continue
+        buffer = encode_png(img, colors, compress_type, timer)
+        encodes += 1
+        size = buffer.tell()
+        if size <= max_size_bytes:
+            return buffer, img.size, colors, encodes
+        buffer.close()
+        if colors == PNG_PALETTE_STEPS[0]:
+            base_size = size
+        if size > max_size_bytes * PNG_PALETTE_REACH:
+            break
+
+    colors = PNG_PALETTE_STEPS[0]
+
+    def encode_palette(resized, output_format, quality, timer):
+        return encode_png(resized, colors, compress_type, timer)
+
+    buffer, dims, resize_encodes = downscale_to_fit(img, 'PNG', 0, max_size_bytes, base_size, timer,
+                                                    encode=encode_palette)
+    return buffer, dims, colors, encodes + resize_encodes
+
+
+def compress_animation(img, output_format, options, timer=NULL_TIMER):
+    """压缩 GIF（含动图），输出 GIF 或动态 WebP/AVIF，保留全部帧
+
+    GIF 与 PNG 一样体积与 quality 无关：先整体重新编码（合并相同帧），再依次
+    减少调色板颜色数，最后缩小尺寸。WebP/AVIF 先搜索质量，不够时再缩小。
+    返回 (buffer, quality, (宽, 高), colors, encodes)，失败时 buffer 为 None。
+    """
+    max_size_bytes = options.max_size_bytes
+    durations = frame_durations(img) if output_format != 'GIF' else None
+    colors = None
+
+    def encode(frame, output_format, quality, timer):
+        # 搜索和缩放只用 frame 的尺寸，各帧每次都从原图重新读取
+        size = frame.size if frame.size != img.size else None
+        return encode_animation(img, output_format, quality, size, colors, durations, timer)
+
+    if output_format != 'GIF':
+        samples = []
+        buffer, quality, encodes = search_quality(img, output_format, options.quality, max_size_bytes,
+                                                  samples=samples, timer=timer, encode=encode)
+        if buffer is not None:
+            return buffer, quality, img.size, None, encodes
+        quality = resize_quality(options)
+        buffer, dims, resize_encodes = downscale_to_fit(img, output_format, quality, max_size_bytes,
+                                                        estimate_size(samples, quality), timer, encode=encode)
+        return buffer, quality, dims, None, encodes + resize_encodes
+
+    buffer = encode(img, output_format, options.quality, timer)
+    encodes = 1
+    if buffer.tell() <= max_size_bytes:
+        return buffer, options.quality, img.size, None, encodes
+    base_size = buffer.tell()
+    buffer.close()
+    # GIF 编码器默认已是 256 色，从下一档开始减少
+    for colors in PNG_PALETTE_STEPS[1:]:
+        buffer = encode(img, output_format, options.quality, timer)
+        encodes += 1
+        size = buffer.tell()
+        if size <= max_size_bytes:
+            return buffer, options.quality, img.size, colors, encodes
+        buffer.close()
+        if size > max_size_bytes * PNG_PALETTE_REACH:
+            break
+
+    colors = None
+    buffer, dims, resize_encodes = downscale_to_fit(img, output_format, options.quality, max_size_bytes,
+                                                    base_size, timer, encode=encode)
+    return buffer, options.quality, dims, None, encodes + resize_encodes
+
+
+def estimate_size(samples, quality, log_slope=DEFAULT_LOG_SLOPE):
+    """根据质量搜索的样本估算原尺寸在 quality 下的编码体积（只有一个样本时按先验斜率外推）"""
+    for q, size in samples:
+        if q == quality:
+            return size
+    ordered = sorted(samples, key=lambda item: abs(item[0] - quality))
+    (qa, sa) = ordered[0]
+    slope = log_slope
+    if len(ordered) > 1:
+        (qb, sb) = ordered[1]
+        if qa != qb and sa != sb:
+            slope = max(math.log(sa / sb) / (qa - qb), 0)
+    return sa * math.exp(slope * (quality - qa))
+
+
+def downscale_to_fit(img, output_format, quality, max_size_bytes, base_size, timer=NULL_TIMER,
+                     encode=encode_image, pixel_exponent=DEFAULT_PIXEL_EXPONENT, allow_full_size=False):
+    """按预测比例从原图一次缩放到目标体积，必要时再微调
+
+    base_size 为原尺寸在 quality 下的（估算）体积。用 体积 ∝ 像素数^k 预测
+    所需像素比例，每次都从原图重采样，避免多次缩放叠加损失；得到第二个
+    样本后用实测值修正 k（先验值为 pixel_exponent）。找到可用尺寸后在它与
+    最小的超限尺寸之间继续逼近，直到体积达到上限的 SEARCH_FILL_RATIO 或用完
+    DOWNSCALE_MAX_ENCODES 次编码。encode 与 encode_image 参数相同，可替换编码方式。
+    img 的尺寸默认视为已知超限；allow_full_size 为 True 时（如草稿解码后的图片）
+    只作为上界，预测需要时也会按该尺寸编码。
+    返回 (buffer, (宽, 高), encodes)，失败时 buffer 为 None。
+    """
+    width, height = img.size
+    exponent = pixel_exponent
+    ref_pixels, ref_size = width * height, base_size
+    best_buffer, best_dims = None, None
+    # 已知超限的最小像素数；allow_full_size 时原尺寸未知是否超限，上界取原尺寸再多一个像素
+    over_pixels = width * height + 1 if allow_full_size else width * height
+    encodes = 0
+
+    try:
+        while True:
+            target = max_size_bytes * DOWNSCALE_SAFETY
+            pixels = ref_pixels * (target / ref_size) ** (1 / exponent)
+            if best_buffer is not None:
+                # 已有可用结果：只在它与超限尺寸之间尝试放大，预测落在区间外时取中点
+                best_pixels = best_dims[0] * best_dims[1]
+                if not best_pixels < pixels < over_pixels:
+                    pixels = (best_pixels + over_pixels) / 2
+            elif over_pixels > width * height:
+                pixels = min(pixels, width * height)
+            else:
+                pixels = min(pixels, over_pixels * 0.9)
+            scale = math.sqrt(pixels / (width * height))
+            new_width, new_height = int(width * scale), int(height * scale)
+            if new_width < MIN_DIMENSION or new_height < MIN_DIMENSION:
+                # 预测值低于下限时，最后按下限尺寸尝试一次
+                min_scale = MIN_DIMENSION / min(width, height)
+                new_width, new_height = math.ceil(width * min_scale), math.ceil(height * min_scale)
+                if best_buffer is not None or over_pixels <= new_width * new_height:
+                    break
+            if best_dims and (new_width * new_height <= best_dims[0] * best_dims[1]
+                              or new_width * new_height >= over_pixels):
+                # 区间已缩到整数像素的精度
+                break
+
+            if (new_width, new_height) == img.size:
+                buffer = encode(img, output_format, quality, timer)
+            else:
+                with timer.stage("resize") as stage:
+                    resized = img.resize((new_width, new_height), Image.LANCZOS)
+                    stage.bytes = new_width * new_height * len(resized.getbands())
+                buffer = encode(resized, output_format, quality, timer)
+                resized.close()
+            encodes += 1
+            size = buffer.tell()
+
+            # 用实测样本修正体积-像素指数
+            new_pixels = new_width * new_height
+            if new_pixels != ref_pixels and size != ref_size:
+                measured = math.log(size / ref_size) / math.log(new_pixels / ref_pixels)
+                exponent = min(max(measured, 0.5), 1.2)
+            ref_pixels, ref_size = new_pixels, size
+
+            if size <= max_size_bytes:
+                if best_buffer is not None:
+                    best_buffer.close()
+                best_buffer, best_dims = buffer, (new_width, new_height)
+                if size >= max_size_bytes * SEARCH_FILL_RATIO:
+                    break
+            else:
+                buffer.close()
+                over_pixels = new_pixels
+            if best_buffer is not None and encodes >= DOWNSCALE_MAX_ENCODES:
+                break
+    except Exception:
+        if best_buffer is not None:
+            best_buffer.close()
+        raise
+
+    return best_buffer, best_dims, encodes
+
+
+def format_supported(output_format):
+    """当前 Pillow 是否能编码该格式（AVIF 需要 Pillow 11.3+ 或 pillow-avif-plugin）"""
+    if output_format in ("WEBP", "AVIF"):
+        try:
+            return bool(features.check(output_format.lower()))
+        except ValueError:
+            return False
+    return True
+
+
+def is_image_file(file_name):
+    """是否为待压缩的图片（排除本工具生成的 *_compressed_q{质量} 文件）"""
+    stem, ext = os.path.splitext(file_name)
+    return ext.lower() in IMAGE_EXTENSIONS and not OUTPUT_NAME_PATTERN.search(stem)
+
+
+@dataclass
+class ScanEntry:
+    """扫描阶段得到的文件信息（只读取文件头，不解码像素）"""
+    path: str
+    size: int
+    mtime_ns: int
+    action: str = "compress"            # skip: 已小于上限；compress: 需压缩；convert: 需压缩并转换格式；error: 无法读取
+    format: Optional[str] = None
+    dimensions: Optional[Tuple[int, int]] = None
+    mode: Optional[str] = None
+    animated: bool = False              # 多帧 GIF，逐帧压缩，自动策略下保持 GIF 格式
+    frames: int = 1                     # 帧数（动图）
+    error: Optional[str] = None
+
+
+def iter_image_files(folder_path, include_subfolders=True):
+    """用 os.scandir 逐个产出图片文件的 os.DirEntry（stat 结果可直接复用）
+
+    与 os.walk 一致，无法读取的子目录会被忽略；根目录无法读取时抛出 OSError。
+    """
+    folders = [folder_path]
+    while folders:
+        current = folders.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError:
+            if current == folder_path:
+                raise
+            continue
+        with entries:
+            subfolders = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if include_subfolders:
+                        subfolders.append(entry.path)
+                elif is_image_file(entry.name) and entry.is_file():
+                    yield entry
+            folders.extend(reversed(subfolders))
+
+
+def scan_image(path, size, mtime_ns, options):
+    """根据文件大小和文件头决定处理方式"""
+    entry = ScanEntry(path=path, size=size, mtime_ns=mtime_ns)
+    if size < options.max_size_bytes:
+        # 已小于上限的文件连文件头都不用读
+        entry.action = "skip"
+        return entry
+    try:
+        # Image.open 只解析文件头，像素在 load() 时才解码
+        with Image.open(path) as img:
+            entry.format, entry.dimensions, entry.mode = img.format, img.size, img.mode
+            # is_animated 只定位到第二帧，不解码像素
+            entry.animated = img.format == 'GIF' and getattr(img, 'is_animated', False)
+            if entry.animated:
+                # n_frames 要跳过全部帧的数据块（同样不解码像素），只对动图读取
+                entry.frames = img.n_frames
+    except Exception as e:
+        entry.action, entry.error = "error", str(e)
+        return entry
+    if entry.format in ('PNG', 'GIF') and options.png_strategy in CONVERT_FORMATS:
+        if not (entry.animated and CONVERT_FORMATS[options.png_strategy] == 'JPEG'):
+            entry.action = "convert"
+    return entry
+
+
+def scan_path(path, options):
+    stat_result = os.stat(path)
+    return scan_image(path, stat_result.st_size, stat_result.st_mtime_ns, options)
+
+
+def iter_scan_images(folder_path, include_subfolders, options):
+    """边遍历边扫描，逐个产出 ScanEntry，可直接交给 CompressionJob 实现边扫描边压缩"""
+    for dir_entry in iter_image_files(folder_path, include_subfolders):
+        try:
+            stat_result = dir_entry.stat()
+        except OSError as e:
+            yield ScanEntry(path=dir_entry.path, size=0, mtime_ns=0, action="error", error=str(e))
+            continue
+        yield scan_image(dir_entry.path, stat_result.st_size, stat_result.st_mtime_ns, options)
+
+
+def scan_images(folder_path, include_subfolders, options):
+    """扫描整个文件夹，返回 ScanEntry 列表"""
+    return list(iter_scan_images(folder_path, include_subfolders, options))
+
+
+def summarize_scan(entries):
+    """统计扫描结果：各处理方式的数量、待处理的字节数与像素数"""
+    summary = {'total': len(entries), 'skip': 0, 'compress': 0, 'convert': 0, 'error': 0,
+               'work_bytes': 0, 'work_pixels': 0}
+    for entry in entries:
+        summary[entry.action] += 1
+        if entry.action in ("compress", "convert"):
+            summary['work_bytes'] += entry.size
+            summary['work_pixels'] += entry.dimensions[0] * entry.dimensions[1]
+    return summary
+
+
+def estimate_memory(entry, options):
+    """按文件头估算压缩该文件时的峰值内存（字节）
+
+    Pillow 中 1/L/P 模式每像素 1 字节，其余模式按 4 字节计算。峰值时同时存在：
+    解码后的原图、转为 RGB 的副本（仅 convert）、缩放副本，以及当前与最优两个
+    编码缓冲。草稿解码会更小，这里按完整解码保守估算。动图逐帧处理，同时存在
+    当前帧与上一帧两份 RGBA 副本；Pillow 的编码器还会收集全部帧，这部分按帧数
+    计算（GIF 调色板帧实测每像素约 1 字节，留出余量按 2 字节；转为 WebP/AVIF 时按 4 字节）。
+    """
+    width, height = entry.dimensions
+    pixels = width * height
+    decoded = pixels * (1 if entry.mode in ('1', 'L', 'P') else 4)
+    if entry.animated:
+        converted = pixels * 8
+        resized = entry.frames * pixels * (4 if entry.action == "convert" else 2)
+    else:
+        converted = pixels * 4 if entry.action == "convert" else 0
+        resized = converted or decoded  # 缩放副本不超过被缩放的图
+    encoded = max(entry.size, options.max_size_bytes)
+    return decoded + converted + resized + 2 * encoded + FILE_MEMORY_OVERHEAD
+
+
+def make_output_path(input_path, quality):
+    """压缩结果的默认输出路径：原文件名加 _compressed_q{质量} 后缀"""
+    directory, filename = os.path.split(input_path)
+    name, ext = os.path.splitext(filename)
+    return os.path.join(directory, f"{name}_compressed_q{quality}{ext}")
+
+
+@dataclass
+class CompressOptions:
+    """压缩参数"""
+    quality: int = 80              # 起始（最高）质量
+    max_size_mb: float = 10        # 输出大小上限
+    png_strategy: str = "auto"     # auto: PNG/GIF 转为 JPEG；webp/avif: 转为对应格式并保留透明度；keep: 保持原格式
+    draft_decode: bool = True      # 大尺寸 JPEG 必然需要缩小时，用 DCT 缩放直接解码到接近目标尺寸
+    content_aware: bool = True     # 按内容类型（照片/截图/文字图）选择搜索参数，自动策略下平面图保持 PNG/GIF
+    min_ssim: Optional[float] = None  # 感知相似度 (SSIM) 下限，设置后输出满足大小与相似度的最小文件（需要 NumPy）
+
+    @property
+    def max_size_bytes(self):
+        return int(self.max_size_mb * 1024 * 1024)
+
+
+@dataclass
+class CompressResult:
+    """单张图片的压缩结果"""
+    input_path: Optional[str] = None
+    output_path: Optional[str] = None   # 实际输出路径，PNG/GIF 转 JPEG 时扩展名会变化
+    success: bool = False
+    skipped: bool = False
+    skip_reason: Optional[str] = None   # under_limit: 已小于上限；up_to_date: 压缩记录中已有且未改动
+    quality: int = 0                    # 最终质量
+    encodes: int = 0                    # 编码次数
+    output_format: Optional[str] = None
+    original_bytes: Optional[int] = None
+    output_bytes: int = 0
+    original_dimensions: Optional[Tuple[int, int]] = None
+    decoded_dimensions: Optional[Tuple[int, int]] = None  # 实际解码尺寸（草稿解码时小于原尺寸）
+    output_dimensions: Optional[Tuple[int, int]] = None
+    palette_colors: Optional[int] = None    # PNG 量化后的调色板颜色数，None 表示未量化
+    content: Optional[str] = None       # 内容类型 (image_classifier.PRESETS 的键)，未分类时为 None
+    ssim: Optional[float] = None        # 输出与原图的 SSIM，只在设置了 min_ssim 且未缩小尺寸时计算（图片太窄时为 None）
+    elapsed: float = 0.0                # 耗时（秒）
+    input_hash: Optional[str] = None    # 输入文件内容哈希（写入压缩记录时计算）
+    error: Optional[str] = None
+    stages: list = field(default_factory=list)  # 各阶段耗时 (stage_timer.Stage)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def resize_quality(options):
+    return max(options.quality, RESIZE_MIN_QUALITY)
+
+
+def plan_draft_decode(input_path, full_size, options):
+    """用 1/8 草稿解码试编码，判断大尺寸 JPEG 是否必然需要缩小
+
+    返回 (草稿解码的目标尺寸, 原尺寸在缩放质量下的估算体积, 编码次数)，
+    不需要缩小时前两项为 None。目标尺寸比预测的最终尺寸多留 DRAFT_HEADROOM 的余量。
+    """
+    width, height = full_size
+    with Image.open(input_path) as probe:
+        probe.draft(probe.mode, (width // DRAFT_PROBE_SCALE, height // DRAFT_PROBE_SCALE))
+        growth = (width * height / (probe.width * probe.height)) ** DEFAULT_PIXEL_EXPONENT
+        with encode_image(probe, 'JPEG', MIN_QUALITY) as buffer:
+            floor_estimate = buffer.tell() * growth
+        if floor_estimate <= options.max_size_bytes * DRAFT_CERTAINTY:
+            return None, None, 1
+        with encode_image(probe, 'JPEG', resize_quality(options)) as buffer:
+            estimate = buffer.tell() * growth
+
+    target_pixels = width * height * (options.max_size_bytes * DOWNSCALE_SAFETY / estimate) ** (1 / DEFAULT_PIXEL_EXPONENT)
+    # 留出余量：草稿尺寸只作为上界，由 downscale_to_fit 在其中找最终尺寸
+    scale = min(math.sqrt(target_pixels * DRAFT_HEADROOM / (width * height)), 1)
+    return (int(width * scale), int(height * scale)), estimate, 2
+
+
+def compress_image(img, options, resize_estimate=None, search_threads=1, timer=NULL_TIMER):
+    """在内存中压缩已打开的图片，返回 (buffer, CompressResult)
+
+    按 options.png_strategy 决定输出格式，先搜索质量，不够时再按预测比例缩小；
+    保持 PNG 格式时改用 compress_png（无损重编码、调色板量化），GIF 动图和
+    GIF 输出改用 compress_animation（逐帧处理，自动策略下动图保持 GIF）。
+    options.content_aware 为 True 时先对图片分类，按类型选择搜索的先验参数，
+    自动策略下颜色少或带透明度的平面图保持原格式。设置了 options.min_ssim 时，
+    找到满足大小的质量后继续降低到相似度下限；该质量已低于下限则改为缩小尺寸。
+    resize_estimate 为当前尺寸在缩放质量下的估算体积，给出时表示已确定需要缩小，
+    跳过质量搜索。search_threads 大于 1 时用多线程同时试编码多个质量。
+    无法压缩到上限以内时 buffer 为 None；成功时由调用方负责关闭 buffer。
+    """
+    result = CompressResult(quality=options.quality, original_dimensions=img.size, decoded_dimensions=img.size)
+    max_size_bytes = options.max_size_bytes
+    
+    # Pillow 延迟解码，单独计时以便与编码区分
+    with timer.stage("decode") as stage:
+        img.load()
+        stage.bytes = img.width * img.height * len(img.getbands())
+    
+    output_format = img.format
+    animated = img.format == 'GIF' and getattr(img, 'is_animated', False)
+    log_slope, pixel_exponent, keep_format = DEFAULT_LOG_SLOPE, DEFAULT_PIXEL_EXPONENT, False
+    if options.content_aware and not animated:
+        with timer.stage("classify") as stage:
+            preset, stats = classify_image(img)
+            stage.bytes = img.width * img.height
+        result.content = preset.name
+        log_slope, pixel_exponent = preset.log_slope, preset.pixel_exponent
+        # 平面图转 JPEG 会出现色块和振铃，调色板 PNG/GIF 通常更小也更清晰
+        keep_format = options.png_strategy == "auto" and prefers_palette(preset, stats)
+    if img.format in ('PNG', 'GIF') and options.png_strategy in CONVERT_FORMATS and not keep_format:
+        output_format = CONVERT_FORMATS[options.png_strategy]
+        if animated and output_format == 'JPEG':
+            # JPEG 没有动画，自动策略下动图保持 GIF 格式
+            output_format = 'GIF'
+        if not format_supported(output_format):
+            result.error = f"当前 Pillow 不支持 {output_format} 编码"
+            return None, result
+        if not animated:
+            # JPEG 不支持透明度；WebP/AVIF 保留透明通道，且只在搜索前转换一次模式
+            mode = 'RGBA' if output_format != 'JPEG' and img.has_transparency_data else 'RGB'
+            with timer.stage("convert") as stage:
+                img = img.convert(mode)
+                stage.bytes = img.width * img.height * len(mode)
+    result.output_format = output_format
+    
+    if animated or output_format in ('GIF', 'PNG'):
+        if output_format == 'PNG':
+            buffer, dims, result.palette_colors, result.encodes = compress_png(img, max_size_bytes, timer)
+        else:
+            # 逐帧处理，保留动画
+            buffer, result.quality, dims, result.palette_colors, result.encodes = compress_animation(
+                img, output_format, options, timer)
+        if buffer is None and keep_format:
+            # 按内容保持原格式却无法满足上限时，仍按自动策略转 JPEG
+            buffer, fallback = compress_image(img, replace(options, content_aware=False), None, search_threads, timer)
+            fallback.encodes += result.encodes
+            fallback.content, fallback.original_dimensions = result.content, result.original_dimensions
+            return buffer, fallback
+        if buffer is None:
+            result.error = "无法压缩到指定大小"
+            return None, result
+        result.success, result.output_bytes, result.output_dimensions = True, buffer.tell(), dims
+        return buffer, result
+    
+    # BMP 等格式的体积与 quality 无关，只编码一次就转为缩小尺寸
+    quality_matters = output_format in QUALITY_FORMATS
+    buffer = None
+    if resize_estimate is None:
+        samples = []
+        if search_threads > 1 and quality_matters:
+            buffer, final_quality, encodes = parallel_search_quality(img, output_format, options.quality,
+                                                                     max_size_bytes, search_threads,
+                                                                     samples=samples, timer=timer,
+                                                                     log_slope=log_slope)
+        else:
+            min_quality = MIN_QUALITY if quality_matters else options.quality
+            buffer, final_quality, encodes = search_quality(img, output_format, options.quality, max_size_bytes,
+                                                            min_quality, samples=samples, timer=timer,
+                                                            log_slope=log_slope)
+        result.encodes = encodes
+    if buffer is not None and options.min_ssim and SSIM_AVAILABLE and quality_matters:
+        with timer.stage("ssim"):
+            reference = SimilarityReference(img)
+            score = reference.score(buffer)
+        if score is None:
+            # 图片比 SSIM 窗口还窄，相似度无法衡量：不应用下限，保留按大小搜索的结果
+            pass
+        elif score >= options.min_ssim:
+            buffer, final_quality, result.ssim, encodes = lower_to_similarity(
+                img, output_format, final_quality, buffer, score, reference, options.min_ssim, timer=timer)
+            result.encodes += encodes
+        elif final_quality < resize_quality(options):
+            # 满足大小的最高质量已明显失真，缩小尺寸后用较高质量编码更好
+            buffer.close()
+            buffer = None
+        else:
+            # 质量已不低于缩放时的质量，缩小尺寸也不会更接近原图
+            result.ssim = score
+    if buffer is not None:
+        result.quality, result.output_dimensions = final_quality, img.size
+    else:
+        # 仅靠降低质量不够时，按预测比例缩小尺寸
+        adjusted_quality = resize_quality(options) if quality_matters else options.quality
+        base_size = resize_estimate or estimate_size(samples, adjusted_quality, log_slope)
+        buffer, dims, resize_encodes = downscale_to_fit(img, output_format, adjusted_quality,
+                                                        max_size_bytes, base_size, timer,
+                                                        pixel_exponent=pixel_exponent,
+                                                        allow_full_size=resize_estimate is not None)
+        result.encodes += resize_encodes
+        if buffer is None:
+            result.error = "无法压缩到指定大小"
+            return None, result
+        result.quality, result.output_dimensions = adjusted_quality, dims
+    
+    result.success = True
+    result.output_bytes = buffer.tell()
+    return buffer, result
+
+
+def write_atomic(output_path, buffer):
+    """把 BytesIO 的内容写入文件
+
+    直接写出 getbuffer() 的内存视图，不再像 getvalue() 那样复制一份；先写入同目录的
+    隐藏临时文件再重命名，文件夹里不会出现写了一半的输出。
+    """
+    directory, filename = os.path.split(os.path.abspath(output_path))
+    temp_path = os.path.join(directory, f".{filename}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_path, 'wb') as f, buffer.getbuffer() as view:
+            f.write(view)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def compress_file(input_path, output_path=None, options=None, hash_input=False, search_threads=1):
+    """压缩单张图片文件到 max_size_mb 以内（可在子进程中运行），返回 CompressResult
+
+    output_path 默认为 make_output_path 的结果；输出格式变为 JPEG 时扩展名改为 .jpg。
+    hash_input 为 True 时顺带计算输入文件哈希，供压缩记录使用。
+    search_threads 见 compress_image，批量压缩已按文件并行，保持默认的 1 即可。
+    """
+    options = options or CompressOptions()
+    output_path = output_path or make_output_path(input_path, options.quality)
+    started = time.perf_counter()
+    timer = StageTimer()
+    
+    try:
+        original_bytes = os.path.getsize(input_path)
+        with Image.open(input_path) as img:
+            original_format, original_dimensions = img.format, img.size
+            resize_estimate, probe_encodes = None, 0
+            if options.draft_decode and original_format in ('JPEG', 'MPO') and img.width * img.height >= DRAFT_MIN_PIXELS:
+                with timer.stage("probe"):
+                    draft_size, estimate, probe_encodes = plan_draft_decode(input_path, img.size, options)
+                if draft_size is not None:
+                    # 在解码前设置草稿模式，libjpeg 按 1/2、1/4、1/8 直接缩放解码
+                    img.draft(img.mode, draft_size)
+                    resize_estimate = estimate * (img.width * img.height / (
+                        original_dimensions[0] * original_dimensions[1])) ** DEFAULT_PIXEL_EXPONENT
+            buffer, result = compress_image(img, options, resize_estimate, search_threads, timer)
+        result.encodes += probe_encodes
+        result.original_dimensions = original_dimensions
+        result.input_path, result.original_bytes = input_path, original_bytes
+        
+        if buffer is not None:
+            if result.output_format != original_format:
+                output_path = os.path.splitext(output_path)[0] + OUTPUT_EXTENSIONS[result.output_format]
+            with buffer, timer.stage("write") as stage:
+                write_atomic(output_path, buffer)
+                stage.bytes = result.output_bytes
+            result.output_path = output_path
+            if hash_input:
+                with timer.stage("hash") as stage:
+                    result.input_hash = file_hash(input_path)
+                    stage.bytes = original_bytes
+    except Exception as e:
+        result = CompressResult(input_path=input_path, quality=options.quality, error=str(e))
+    
+    result.elapsed = time.perf_counter() - started
+    result.stages = timer.stages
+    return result
+
+
+class CompressionJob:
+    """后台压缩任务
+
+    entries 为 ScanEntry 的列表或生成器（如 iter_scan_images），由扫描线程
+    逐个取出放入有界队列，发现第一个文件即可开始压缩；discovered 为已发现的
+    文件数，scan_finished 表示扫描是否结束。
+    在独立线程中调度进程池（或线程池），结果通过线程安全的 events 队列
+    交给界面线程。事件为 ('result', CompressResult) 或 ('done', 最终状态)。
+    正在执行的文件最多为 worker_count * 2 个，暂停/取消只需停止提交新文件。
+    指定 index_path 时使用压缩记录跳过未改动的文件，并记录新的压缩结果。
+    指定 memory_budget_mb 时按 estimate_memory 估算每个文件的峰值内存，只有
+    已提交文件的估算总和（加上工作进程自身占用）不超过预算时才提交下一个；
+    没有正在处理的文件时总会提交，单个超预算的大文件会独占执行。
+    search_threads 传给 compress_file，单文件压缩时用多线程试编码缩短等待时间。
+    """
+
+    _SCAN_DONE = object()
+
+    def __init__(self, entries, options, worker_count=1, use_processes=True, index_path=None,
+                 memory_budget_mb=None, search_threads=1):
+        self.entries = entries
+        self.discovered = 0
+        self.scan_finished = False
+        self._entry_queue = queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+        self.options = options
+        self.worker_count = max(1, worker_count)
+        self.use_processes = use_processes
+        self.index_path = index_path
+        self._index = None
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024) if memory_budget_mb else None
+        self.memory_in_use = 0      # 已提交文件的估算内存总和
+        self._footprints = {}       # future -> 估算内存
+        self.search_threads = search_threads
+        self.events = queue.Queue()
+        self.state = "pending"  # pending / running / paused / cancelling / finished / cancelled
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def is_active(self):
+        return self.state in ("pending", "running", "paused", "cancelling")
+
+    def start(self):
+        self.state = "running"
+        threading.Thread(target=self._scan, daemon=True).start()
+        self._thread.start()
+
+    def pause(self):
+        if self.state == "running":
+            self._resume_event.clear()
+            self.state = "paused"
+
+    def resume(self):
+        if self.state == "paused":
+            self.state = "running"
+            self._resume_event.set()
+
+    def cancel(self):
+        if self.state in ("running", "paused"):
+            self.state = "cancelling"
+            self._cancel_event.set()
+            self._resume_event.set()
+
+    def _scan(self):
+        """扫描线程：把 entries 逐个放入有界队列"""
+        try:
+            for entry in self.entries:
+                self.discovered += 1
+                if not self._put_entry(entry):
+                    return
+        except Exception as e:
+            self.events.put(('result', CompressResult(error=f"扫描失败: {e}")))
+        finally:
+            self.scan_finished = True
+        self._put_entry(self._SCAN_DONE)
+
+    def _put_entry(self, entry):
+        while not self._cancel_event.is_set():
+            try:
+                self._entry_queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        executor_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        max_in_flight = self.worker_count * 2
+        exhausted = False
+        pending = {}  # future -> ScanEntry
+        held = None   # 因内存预算暂缓提交的文件
+        if self.memory_budget:
+            budget = self.memory_budget - WORKER_BASE_MEMORY * (self.worker_count if self.use_processes else 1)
+
+        try:
+            # SQLite 连接只能在创建它的线程中使用，因此在任务线程里打开
+            if self.index_path:
+                self._index = CompressionIndex(self.index_path)
+            # 扫描线程运行时 fork 出的子进程可能继承被占用的锁而卡死，统一用 spawn（Windows 默认方式）
+            pool_options = {'mp_context': multiprocessing.get_context("spawn")} if self.use_processes else {}
+            with executor_class(max_workers=self.worker_count, **pool_options) as executor:
+                while True:
+                    if self._cancel_event.is_set():
+                        break
+
+                    # 暂停时不提交新文件，已提交的继续完成
+                    while not exhausted and self._resume_event.is_set() and len(pending) < max_in_flight:
+                        if held is not None:
+                            entry, held = held, None
+                        else:
+                            try:
+                                # 没有正在处理的文件时短暂等待扫描线程，否则只取已扫描到的
+                                entry = self._entry_queue.get(timeout=0.1) if not pending else \
+                                    self._entry_queue.get_nowait()
+                            except queue.Empty:
+                                break
+                            if entry is self._SCAN_DONE:
+                                exhausted = True
+                                break
+                            skip_result = self._check_skip(entry)
+                            if skip_result is not None:
+                                self.events.put(('result', skip_result))
+                                continue
+                        footprint = 0
+                        if self.memory_budget:
+                            footprint = estimate_memory(entry, self.options)
+                            if pending and self.memory_in_use + footprint > budget:
+                                # 等已提交的文件完成、释放内存后再提交
+                                held = entry
+                                break
+                        future = executor.submit(compress_file, entry.path, None, self.options,
+                                                 self._index is not None, self.search_threads)
+                        pending[future] = entry
+                        self._footprints[future] = footprint
+                        self.memory_in_use += footprint
+
+                    if not pending:
+                        if exhausted:
+                            break
+                        if not self._resume_event.is_set():
+                            self._resume_event.wait(0.1)
+                        continue
+
+                    finished, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self._post_result(future, pending.pop(future))
+
+                # 取消：撤回尚未开始的文件，等待正在执行的文件结束
+                for future in list(pending):
+                    if future.cancel():
+                        pending.pop(future)
+                        self.memory_in_use -= self._footprints.pop(future)
+                for future in list(pending):
+                    wait([future])
+                    self._post_result(future, pending.pop(future))
+        except Exception as e:
+            self.events.put(('result', CompressResult(error=str(e))))
+        finally:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+
+        self.state = "cancelled" if self._cancel_event.is_set() else "finished"
+        self.events.put(('done', self.state))
+
+    def _check_skip(self, entry):
+        """不需要压缩时返回对应的结果，否则返回 None"""
+        if entry.action == "error":
+            return CompressResult(input_path=entry.path, original_bytes=entry.size or None, error=entry.error)
+        if entry.action == "skip":
+            return CompressResult(input_path=entry.path, skipped=True, skip_reason="under_limit",
+                                  original_bytes=entry.size)
+        if self._index is not None:
+            try:
+                record = self._index.lookup(entry.path, entry.size, entry.mtime_ns, self.options)
+            except OSError as e:
+                return CompressResult(input_path=entry.path, error=str(e))
+            if record is not None:
+                output_path, output_bytes = record
+                return CompressResult(input_path=entry.path, output_path=output_path, skipped=True,
+                                      skip_reason="up_to_date", original_bytes=entry.size,
+                                      output_bytes=output_bytes)
+        return None
+
+    def _post_result(self, future, entry):
+        self.memory_in_use -= self._footprints.pop(future, 0)
+        try:
+            result = future.result()
+        except Exception as e:
+            result = CompressResult(input_path=entry.path, error=str(e))
+        if result.success and self._index is not None:
+            try:
+                self._index.record(result, entry.size, entry.mtime_ns, self.options)
+            except Exception as e:
+                result.error = f"写入压缩记录失败: {e}"
+        self.events.put(('result', result))
@@ -0,0 +1,104 @@
+"""公众号工具集 - 感知相似度
+
+在缩小的原图与压缩结果上计算 SSIM（结构相似度，1 为完全相同），压缩引擎据此在
+满足大小上限的前提下继续降低质量，直到相似度接近下限，得到最小的输出。
+计算依赖 NumPy；未安装时 SSIM_AVAILABLE 为 False，引擎只按大小压缩。不依赖 tkinter。
+"""
+
+import io
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+SSIM_AVAILABLE = np is not None
+SSIM_SIZE = 2048            # 比较前按 1/2、1/4、1/8 缩小，直到最长边不超过 2048 像素（约为手机屏幕宽度的两倍）
+DEFAULT_MIN_SSIM = 0.98     # 推荐的相似度下限，在此尺寸下肉眼基本看不出差别
+SSIM_WINDOW = 8             # SSIM 局部窗口边长
+SSIM_STRIP_ROWS = 128       # 按行分段计算，限制中间数组占用的内存
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+
+def box_mean(values, size):
+    """用积分图计算所有 size x size 窗口的均值（只保留完整窗口）"""
+    height, width = values.shape
+    total = np.zeros((height + 1, width + 1))
+    inner = total[1:, 1:]
+    np.cumsum(values, axis=0, out=inner)
+    np.cumsum(inner, axis=1, out=inner)
+    # 原地运算，减少临时数组
+    window = total[size:, size:] - total[:-size, size:]
+    window -= total[size:, :-size]
+    window += total[:-size, :-size]
+    window *= 1 / (size * size)
+    return window
+
+
+def ssim_map(a, b, window=SSIM_WINDOW):
+    """两张同尺寸灰度图（float64 数组）每个窗口的 SSIM"""
+    mu_a, mu_b = box_mean(a, window), box_mean(b, window)
+    var_a = box_mean(a * a, window) - mu_a * mu_a
+    var_b = box_mean(b * b, window) - mu_b * mu_b
+    covar = box_mean(a * b, window) - mu_a * mu_b
+    return ((2 * mu_a * mu_b + SSIM_C1) * (2 * covar + SSIM_C2)) / (
+        (mu_a * mu_a + mu_b * mu_b + SSIM_C1) * (var_a + var_b + SSIM_C2))
+
+
+def ssim(a, b, window=SSIM_WINDOW):
+    """两张同尺寸灰度图的平均 SSIM，每段 SSIM_STRIP_ROWS 行窗口分别计算后汇总
+
+    图片的宽或高小于 window 时没有完整窗口，无法计算，返回 None。
+    """
+    if min(a.shape) < window:
+        return None
+    total, count = 0.0, 0
+    for top in range(0, max(a.shape[0] - window + 1, 1), SSIM_STRIP_ROWS):
+        rows = slice(top, top + SSIM_STRIP_ROWS + window - 1)
+        score = ssim_map(a[rows], b[rows], window)
+        total += float(score.sum())
+        count += score.size
+    return total / count
+
+
+def luma(img, factor, size):
+    """转为灰度并按 factor 缩小到 size，返回 float64 数组
+
+    原图与压缩结果必须经过相同的缩小方式，否则缩放本身的差异会拉低 SSIM。
+    JPEG 草稿解码已按 DCT 缩放过时，factor 为解码后还需缩小的倍数。
+    """
+    img = img.convert('L')
+    if factor > 1:
+        img = img.reduce(factor)
+    if img.size != size:
+        img = img.resize(size, Image.BOX)
+    return np.asarray(img, dtype=np.float64)
+
+
+class SimilarityReference:
+    """缩小后的原图，多次与不同质量的编码结果比较时只准备一次"""
+
+    def __init__(self, img):
+        self.factor = 1
+        # 短边缩小后仍需容纳 SSIM 窗口（如 20000x40 的长图只缩小到 1/4）
+        while (max(img.size) // self.factor > SSIM_SIZE and self.factor < 8
+               and min(img.size) // (self.factor * 2) >= SSIM_WINDOW):
+            self.factor *= 2
+        self.source_width = img.width
+        self.pixels = luma(img, self.factor, (-(-img.width // self.factor), -(-img.height // self.factor)))
+        self.size = (self.pixels.shape[1], self.pixels.shape[0])
+
+    def score(self, buffer):
+        """解码 buffer 中的压缩结果并返回与原图的 SSIM（不移动 buffer 的写入位置）
+
+        图片比 SSIM 窗口还窄、无法计算时返回 None。
+        """
+        with Image.open(io.BytesIO(buffer.getvalue())) as decoded:
+            # JPEG 按 DCT 缩放直接解码到接近比较尺寸，省去完整解码。draft 按尺寸向下取整
+            # 选择缩放比例，尺寸不能整除时（如 5000x3333）可能只缩小到 1/2，剩余部分再用 reduce 缩小
+            decoded.draft('RGB', self.size)
+            scale = round(self.source_width / decoded.width)
+            return ssim(self.pixels, luma(decoded, self.factor // scale, self.size))
@@ -0,0 +1,127 @@
+"""公众号工具集 - 分阶段计时
+
+记录图片处理各阶段（解码、转换、缩放、编码、写盘、下载等）的耗时与字节数，
+压缩引擎、图片拼接和封面图提取共用，结果可在诊断页查看并导出 CSV。
+不依赖 tkinter。
+"""
+
+import csv
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+
+PERF_LOG_LIMIT = 1000       # 诊断页最多保留的操作记录数
+
+CSV_FIELDS = ["time", "tool", "target", "stage", "count", "seconds", "bytes"]
+
+
+@dataclass
+class Stage:
+    """同名阶段的累计数据"""
+    name: str
+    count: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+
+
+class StageTimer:
+    """按阶段名累计耗时，阶段顺序为首次出现的顺序（可在多个线程中同时使用）
+
+    用法：
+        with timer.stage("encode") as stage:
+            buffer = encode(...)
+            stage.bytes = buffer.tell()
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        record = Stage(name, count=1)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            with self._lock:
+                total = self._stages.setdefault(name, Stage(name))
+                total.count += 1
+                total.seconds += record.seconds
+                total.bytes += record.bytes
+
+    @property
+    def stages(self):
+        return list(self._stages.values())
+
+
+class NullTimer:
+    """不记录任何数据的计时器，作为各函数 timer 参数的默认值"""
+
+    @contextmanager
+    def stage(self, name):
+        yield Stage(name)
+
+    @property
+    def stages(self):
+        return []
+
+
+NULL_TIMER = NullTimer()
+
+
+@dataclass
+class PerfRecord:
+    """一次操作（压缩一张图、拼接一次、提取一次封面）的分阶段耗时"""
+    tool: str
+    target: str
+    stages: list
+    time: str = ""
+
+    def __post_init__(self):
+        self.time = self.time or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    @property
+    def total_seconds(self):
+        return sum(stage.seconds for stage in self.stages)
+
+
+class PerfLog:
+    """最近的操作记录，超过 limit 条时丢弃最早的记录"""
+
+    def __init__(self, limit=PERF_LOG_LIMIT):
+        self.records = deque(maxlen=limit)
+
+    def add(self, tool, target, stages):
+        record = PerfRecord(tool, target, list(stages))
+        self.records.append(record)
+        return record
+
+    def clear(self):
+        self.records.clear()
+
+    def summary(self):
+        """按 (工具, 阶段) 汇总全部记录，返回 {工具: [Stage, ...]}"""
+        totals = {}
+        for record in self.records:
+            tool_stages = totals.setdefault(record.tool, {})
+            for stage in record.stages:
+                total = tool_stages.setdefault(stage.name, Stage(stage.name))
+                total.count += stage.count
+                total.seconds += stage.seconds
+                total.bytes += stage.bytes
+        return {tool: list(stages.values()) for tool, stages in totals.items()}
+
+    def write_csv(self, path):
+        """每个阶段一行导出 CSV（UTF-8 带 BOM，便于 Excel 直接打开）"""
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_FIELDS)
+            for record in self.records:
+                for stage in record.stages:
+                    writer.writerow([record.time, record.tool, record.target, stage.name, stage.count,
+                                     f"{stage.seconds:.6f}", stage.bytes])